@@ -0,0 +1,146 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, AsyncIterator
+
+
+class AdmissionRejected(Exception):
+    """Raised when the wait queue of a model is full"""
+
+    def __init__(self, model: str, retry_after: float):
+        super().__init__(f"Too many pending generations for {model}")
+        self.model = model
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """A generation admitted or waiting to be admitted"""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.admitted = False
+        self.started: float | None = None
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        self._changed.set()
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrency: int = 2,
+        max_queue: int = 32,
+        concurrency: dict[str, int] | None = None,
+        initial_duration: float = 10.0,
+        metrics_dist: dict[str, Any] | None = None,
+    ):
+        """
+        Limit the number of generations running per model
+
+        Each model runs at most max_concurrency generations, or its value in
+        concurrency, and up to max_queue more wait in FIFO order. Requests
+        beyond that are rejected immediately. Waiting requests are told
+        their position and an ETA based on a moving average of generation
+        durations. Only generations are admitted, cache hits never wait.
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.concurrency = concurrency if concurrency is not None else {}
+        self.initial_duration = initial_duration
+        self.metrics_dist = metrics_dist if metrics_dist is not None else {}
+        self._running: dict[str, int] = {}
+        self._waiting: dict[str, deque[Ticket]] = {}
+        self._durations: dict[str, float] = {}
+
+    def _limit(self, model: str) -> int:
+        return self.concurrency.get(model, self.max_concurrency)
+
+    def queue_size(self) -> int:
+        """
+        Number of generations waiting over all models
+        """
+        return sum(len(waiting) for waiting in self._waiting.values())
+
+    def _eta(self, model: str, position: int) -> float:
+        duration = self._durations.get(model, self.initial_duration)
+        return math.ceil(position / self._limit(model)) * duration
+
+    def enqueue(self, model: str) -> Ticket:
+        """Admits a generation of model or queues it
+
+        Args:
+            model: ollama model used for generation
+
+        Returns:
+            Ticket to wait on and release once the generation ends
+
+        Raises:
+            AdmissionRejected: when the wait queue of the model is full
+        """
+        waiting = self._waiting.setdefault(model, deque())
+        ticket = Ticket(model)
+        if self._running.get(model, 0) < self._limit(model) and not waiting:
+            self._admit(ticket)
+            return ticket
+        if len(waiting) >= self.max_queue:
+            if "admission_rejections" in self.metrics_dist:
+                self.metrics_dist["admission_rejections"].add(
+                    1, attributes={"model": model}
+                )
+            raise AdmissionRejected(model, self._eta(model, len(waiting) + 1))
+        waiting.append(ticket)
+        return ticket
+
+    def _admit(self, ticket: Ticket) -> None:
+        ticket.admitted = True
+        ticket.started = time.monotonic()
+        self._running[ticket.model] = self._running.get(ticket.model, 0) + 1
+
+    def position(self, ticket: Ticket) -> int:
+        """
+        Position of a waiting ticket in its queue, starting at 1, or 0 once
+        it is admitted
+        """
+        if ticket.admitted:
+            return 0
+        return self._waiting[ticket.model].index(ticket) + 1
+
+    async def wait(self, ticket: Ticket) -> AsyncIterator[tuple[int, float]]:
+        """Waits until ticket is admitted
+
+        Returns:
+            Async iterator of queue position and ETA in seconds, updated
+            whenever the queue moves
+        """
+        while not ticket.admitted:
+            position = self.position(ticket)
+            yield position, self._eta(ticket.model, position)
+            await ticket._changed.wait()
+            ticket._changed.clear()
+
+    def release(self, ticket: Ticket) -> None:
+        """Ends an admitted generation or leaves the queue
+
+        Args:
+            ticket: ticket returned by enqueue
+        """
+        model = ticket.model
+        if ticket.admitted:
+            self._running[model] -= 1
+            assert ticket.started is not None
+            duration = time.monotonic() - ticket.started
+            previous = self._durations.get(model, duration)
+            self._durations[model] = 0.8 * previous + 0.2 * duration
+        elif ticket in self._waiting[model]:
+            self._waiting[model].remove(ticket)
+
+        waiting = self._waiting[model]
+        while waiting and self._running.get(model, 0) < self._limit(model):
+            admitted = waiting.popleft()
+            self._admit(admitted)
+            admitted._notify()
+        # everyone behind moved up
+        for waiter in waiting:
+            waiter._notify()
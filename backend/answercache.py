@@ -0,0 +1,135 @@
+from typing import Any
+from redistore import RedisStore, CachedResponse
+from weaviatestore import WeaviateStore
+from l1cache import L1SemanticCache
+from retrievalcontext import RetrievalContext
+from frames import encode_stream, encode_invoke
+from constants import cache_certainty
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        redis_client: RedisStore,
+        vec_db_client: WeaviateStore,
+        l1_cache: L1SemanticCache | None = None,
+        metrics_dist: dict[str, Any] | None = None,
+    ):
+        """
+        Two tier answer cache
+
+        Answers live in Redis keyed by the prompt hash. The semantic tier
+        maps similar prompts to those keys through the in-process L1 cache
+        and the weaviate cache collection (L2). Both tiers use
+        cache_ttl_seconds as a sliding expiry. A semantic match whose answer
+        is gone is counted as stale, removed and treated as a miss.
+        """
+        self.redis_client = redis_client
+        self.vec_db_client = vec_db_client
+        self.l1_cache = l1_cache
+        self.metrics_dist = metrics_dist if metrics_dist is not None else {}
+
+    def _record(self, tier: str, result: str) -> None:
+        if "cache_lookups" in self.metrics_dist:
+            self.metrics_dist["cache_lookups"].add(
+                1, attributes={"tier": tier, "result": result}
+            )
+
+    async def lookup_exact(self, prompt: str) -> CachedResponse | None:
+        """Looks up the exact prompt without embedding it
+
+        Args:
+            prompt: user prompt
+
+        Returns:
+            Cached answer or None on a miss
+        """
+        cached_data = await self.redis_client.retrieve_exact(prompt)
+        self._record("exact", "miss" if cached_data is None else "hit")
+        # keep the semantic entry of a hot answer from expiring or being
+        # evicted by the sweeper
+        if cached_data is not None and cached_data.uuid is not None:
+            await self.vec_db_client.touch_vector_cache(cached_data.uuid)
+        return cached_data
+
+    async def lookup_semantic(
+        self, ctx: RetrievalContext
+    ) -> CachedResponse | None:
+        """Looks up answers of prompts similar to the one in ctx
+
+        Args:
+            ctx: retrieval context holding the query and its embedding
+
+        Returns:
+            Cached answer or None on a miss
+        """
+        if self.l1_cache is not None:
+            l1_result = self.l1_cache.search(ctx.vector, cache_certainty)
+            if l1_result is not None:
+                query, uuid = l1_result
+                cached_data = await self.redis_client.retrieve_data(query)
+                if cached_data is not None:
+                    self._record("l1", "hit")
+                    if uuid is not None:
+                        await self.vec_db_client.touch_vector_cache(uuid)
+                    return cached_data
+                self._record("l1", "stale")
+                self.l1_cache.remove(query)
+                if uuid is not None:
+                    await self.vec_db_client.delete_vector_cache(uuid)
+            else:
+                self._record("l1", "miss")
+
+        result = await self.vec_db_client.search_vector_cache(ctx)
+        if len(result) == 0:
+            self._record("l2", "miss")
+            return None
+
+        match = result[0]
+        cached_data = await self.redis_client.retrieve_data(match.query)
+        if cached_data is None:
+            self._record("l2", "stale")
+            await self.vec_db_client.delete_vector_cache(match.uuid)
+            return None
+
+        self._record("l2", "hit")
+        if self.l1_cache is not None:
+            self.l1_cache.insert(match.query, match.vector, match.uuid)
+        return cached_data
+
+    async def mark_pending(self, ctx: RetrievalContext) -> None:
+        """Records a pending semantic entry for a prompt being generated
+
+        Pending entries are never returned by lookups.
+
+        Args:
+            ctx: retrieval context holding the query and its embedding
+        """
+        ctx.cache_uuid = await self.vec_db_client.insert_vector_cache(ctx)
+
+    async def store(
+        self, ctx: RetrievalContext, completion: str, links: list[str]
+    ) -> None:
+        """Stores a generated answer and makes its semantic entry ready
+
+        The answer is stored as the ready to send stream and invoke response
+        bodies, with the uuid of its semantic entry so exact hits can touch
+        it. It is written before the entry is marked ready, so a ready
+        entry always has a value until both expire.
+
+        Args:
+            ctx: retrieval context holding the query and its embedding
+            completion: generated answer
+            links: links of the retrieved documents
+        """
+        if ctx.cache_uuid is None:
+            await self.mark_pending(ctx)
+        value = CachedResponse(
+            stream=encode_stream(completion, links),
+            invoke=encode_invoke(completion, links),
+            uuid=ctx.cache_uuid,
+        )
+        await self.redis_client.store_data(ctx.prompt, value)
+        await self.vec_db_client.mark_ready(ctx.cache_uuid)
+        if self.l1_cache is not None:
+            self.l1_cache.insert(ctx.prompt, ctx.vector, ctx.cache_uuid)
@@ -1,35 +1,47 @@
+import asyncio
 import io
+import math
 from pydantic import BaseModel, Field
-from typing import AsyncGenerator, Optional
-from langchain_ollama import OllamaLLM
-from litestar import Litestar, post, get
-from litestar.response import Stream
+from typing import AsyncGenerator, AsyncIterator, Optional
+from litestar import Litestar, MediaType, post, get
+from litestar.response import Response, Stream
 from litestar.di import Provide
 from litestar.datastructures import State
-from langchain.chains.retrieval import create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_core.prompts import ChatPromptTemplate
-from utils import get_num_tokens
+from utils import TokenUsageHandler, load_encoding
 from redistore import RedisStore
-from shared.api_models import LlmCompletionSchema, ModelSchema
-from litestar.serialization import encode_json
+from shared.api_models import ModelSchema
+from frames import encode_frame, encode_invoke, coalesce_tokens, STREAM_MEDIA_TYPE
 from litestar.contrib.opentelemetry import OpenTelemetryConfig, OpenTelemetryPlugin
 from litestar.exceptions import HTTPException
-from constants import system_prompt, collection_name, alpha, k
-from langchain_weaviate.vectorstores import WeaviateVectorStore
-import ollama
 import weaviate
-from teiembedding import TextEmbeddingsInference
+from shared.teiembedding import TextEmbeddingsInference
 from opentelemetry.sdk.resources import SERVICE_NAME, Resource
 from opentelemetry import metrics
+from opentelemetry.metrics import Observation
 from langchain_core.runnables.config import RunnableConfig
-from opentelemetry.metrics._internal.instrument import Counter
+from langchain_core.documents import Document
+from opentelemetry.metrics._internal.instrument import Counter, Histogram
 from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
 from opentelemetry.sdk.metrics import MeterProvider
 from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
 from langfuse.callback import CallbackHandler
 from appconfig import config
 from weaviatestore import WeaviateStore
+from ragengine import RagEngine
+from retrievalcontext import QueryEmbedder, RetrievalContext
+from embeddingcoalescer import EmbeddingCoalescer
+from l1cache import L1SemanticCache
+from answercache import AnswerCache
+from cachewriter import CacheWriter
+from cachesweeper import CacheSweeper
+from constants import cache_ttl_seconds, cache_certainty
+from singleflight import Flight, LocalFollower, RemoteFollower, SingleFlight
+from stagetimer import StageTimer
+from modelwarmer import ModelWarmer
+from retrievalcache import RetrievalCache
+from contextpacker import ContextPacker
+from admission import AdmissionController, AdmissionRejected, Ticket
+from ollamapool import OllamaEndpoint, OllamaPool
 
 OLLAMA_HOST = config.ollama_host
 OLLAMA_PORT = config.ollama_port
@@ -37,20 +49,42 @@ WEAVIATE_HOST = config.weaviate_host
 WEAVIATE_PORT = config.weaviate_port
 TEI_HOST = config.tei_host
 TEI_PORT = config.tei_port
+TEI_BATCH_SIZE = config.tei_batch_size
+TEI_MAX_CONCURRENCY = config.tei_max_concurrency
+EMBEDDING_CACHE_DIR = config.embedding_cache_dir
+EMBED_COALESCE_WINDOW_MS = config.embed_coalesce_window_ms
+EMBED_COALESCE_MAX_BATCH = config.embed_coalesce_max_batch
+L1_CACHE_SIZE = config.l1_cache_size
+CACHE_FLUSH_INTERVAL = config.cache_flush_interval
+CACHE_MAX_ENTRIES = config.cache_max_entries
+CACHE_SWEEP_INTERVAL = config.cache_sweep_interval
+STREAM_FLUSH_INTERVAL_MS = config.stream_flush_interval_ms
+STREAM_FLUSH_MAX_CHARS = config.stream_flush_max_chars
+SPECULATIVE_RETRIEVAL = config.speculative_retrieval
+CONTEXT_TOKEN_BUDGET = config.context_token_budget
+CONTEXT_TOKEN_BUDGETS = config.context_token_budgets
+OLLAMA_URLS = config.ollama_urls or [f"http://{OLLAMA_HOST}:{OLLAMA_PORT}"]
+OLLAMA_KEEP_ALIVE = config.ollama_keep_alive
+GENERATION_CONCURRENCY = config.generation_concurrency
+GENERATION_CONCURRENCY_PER_MODEL = config.generation_concurrency_per_model
+GENERATION_QUEUE_SIZE = config.generation_queue_size
 REDIS_HOST = config.redis_host
 REDIS_PORT = config.redis_port
 EMBEDDING_MODEL = config.model
 LLM = config.llm
 TELEMETRY_ENABLED = config.telemetry_enabled
+CACHE_COMPRESSION = config.cache_compression
 
 meterProvider: MeterProvider | None = None
 metrics_dist: dict[str, Counter] = dict()
+histogram_dist: dict[str, Histogram] = dict()
 langfuse_handler = None
 
 def setup_opentelemetry():
     if not TELEMETRY_ENABLED:
         return
     global metrics_dist
+    global histogram_dist
     global meterProvider
 
     resource = Resource(attributes={SERVICE_NAME: "ragproject"})
@@ -95,6 +129,61 @@ def setup_opentelemetry():
             description="Number of requests to Cache",
             unit="1",
         ),
+        "cache_lookups": meter.create_counter(
+            name="cache.lookups",
+            description="Number of cache lookups by tier and result (hit, miss, stale)",
+            unit="1",
+        ),
+        "cache_writes": meter.create_counter(
+            name="cache.writes",
+            description="Number of deferred writes flushed to the vector cache",
+            unit="1",
+        ),
+        "model_starts": meter.create_counter(
+            name="genai.model.starts",
+            description="Number of ollama responses by whether the model had to "
+            "be loaded (cold) or was already in memory (warm)",
+            unit="1",
+        ),
+        "ollama_failovers": meter.create_counter(
+            name="ollama.failovers",
+            description="Number of requests moved off an unreachable ollama endpoint",
+            unit="1",
+        ),
+        "admission_rejections": meter.create_counter(
+            name="admission.rejections",
+            description="Number of generations rejected because the queue was full",
+            unit="1",
+        ),
+        "cache_evictions": meter.create_counter(
+            name="cache.evictions",
+            description="Number of entries deleted from the vector cache by reason",
+            unit="1",
+        ),
+    }
+
+    histogram_dist = {
+        "embedding_batch_size": meter.create_histogram(
+            name="embedding.batch.size",
+            description="Number of queries sent per coalesced embedding request",
+            unit="1",
+        ),
+        "embedding_batch_wait": meter.create_histogram(
+            name="embedding.batch.wait",
+            description="Time a query waited for its embedding batch to be sent",
+            unit="ms",
+        ),
+        "context_tokens": meter.create_histogram(
+            name="context.tokens",
+            description="Estimated number of tokens of packed context per request",
+            unit="1",
+        ),
+        "request_stage_duration": meter.create_histogram(
+            name="request.stage.duration",
+            description="Time spent in each stage of an llm request, first_token "
+            "is measured from the start of the request",
+            unit="ms",
+        ),
     }
 
 
@@ -127,142 +216,476 @@ class Parameters(BaseModel):
     prompt: str
 
 
-def on_startup(app: Litestar):
+async def on_startup(app: Litestar):
 
     if TELEMETRY_ENABLED:
         setup_opentelemetry()
         setup_langfuse()
 
-    db_client = weaviate.connect_to_local(host=WEAVIATE_HOST, port=(WEAVIATE_PORT))
+    db_client = weaviate.use_async_with_local(host=WEAVIATE_HOST, port=(WEAVIATE_PORT))
+    await db_client.connect()
     tei_url = f"http://{TEI_HOST}:{TEI_PORT}"
-    tei_client = TextEmbeddingsInference(url=tei_url, normalize=True)
+    tei_client = TextEmbeddingsInference(
+        url=tei_url,
+        normalize=True,
+        batch_size=TEI_BATCH_SIZE,
+        max_concurrency=TEI_MAX_CONCURRENCY,
+        model=EMBEDDING_MODEL,
+        cache_dir=EMBEDDING_CACHE_DIR or None,
+        # the loader fills the cache, user prompts are not worth keeping
+        cache_read_only=True,
+    )
+    try:
+        await tei_client.async_server_limits()
+    except Exception as e:
+        # TEI may still be starting, keep the configured batch size
+        print(e)
+    app.state.tei_client = tei_client
+
+    # L1_CACHE_SIZE=0 turns the in-process tier off
+    l1_cache: L1SemanticCache | None = None
+    if L1_CACHE_SIZE > 0:
+        l1_cache = L1SemanticCache(
+            capacity=L1_CACHE_SIZE, ttl_seconds=cache_ttl_seconds
+        )
+    if TELEMETRY_ENABLED:
+        meter = metrics.get_meter("ragproject.backend")
+    if TELEMETRY_ENABLED and l1_cache is not None:
+        meter.create_observable_gauge(
+            name="cache.l1.size",
+            callbacks=[lambda options: [Observation(l1_cache.size())]],
+            description="Number of live entries in the in-process semantic cache",
+            unit="1",
+        )
+        meter.create_observable_counter(
+            name="cache.l1.evictions",
+            callbacks=[lambda options: [Observation(l1_cache.evictions)]],
+            description="Number of entries evicted from the in-process semantic cache",
+            unit="1",
+        )
+
+    cache_writer = CacheWriter(
+        db_client, flush_interval=CACHE_FLUSH_INTERVAL, metrics_dist=metrics_dist
+    )
+    cache_writer.start()
+    app.state.cache_writer = cache_writer
 
     app.state.db_client = WeaviateStore(
         weaviate_client=db_client,
-        tei_client=tei_client,
         embedding_model=EMBEDDING_MODEL,
         llm=LLM,
+        cache_writer=cache_writer,
+    )
+    try:
+        await app.state.db_client.ensure_schema()
+    except Exception as e:
+        print(e)
+    app.state.embedding_coalescer = EmbeddingCoalescer(
+        tei_client,
+        max_wait_ms=EMBED_COALESCE_WINDOW_MS,
+        max_batch_size=EMBED_COALESCE_MAX_BATCH,
+        metrics_dist=histogram_dist,
+    )
+    app.state.query_embedder = QueryEmbedder(app.state.embedding_coalescer)
+    ollama_pool = OllamaPool(OLLAMA_URLS, metrics_dist=metrics_dist)
+    await ollama_pool.check()
+    ollama_pool.start()
+    app.state.ollama_pool = ollama_pool
+    if TELEMETRY_ENABLED:
+        meter.create_observable_gauge(
+            name="ollama.outstanding",
+            callbacks=[
+                lambda options: [
+                    Observation(e.outstanding, attributes={"endpoint": e.url})
+                    for e in ollama_pool.endpoints
+                ]
+            ],
+            description="Number of requests in progress per ollama endpoint",
+            unit="1",
+        )
+    app.state.model_warmer = ModelWarmer(
+        ollama_pool,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+        metrics_dist=metrics_dist,
+    )
+    # load the llm and the embedding model before the first request
+    await app.state.model_warmer.warm(LLM)
+    try:
+        await tei_client.aembed_query("warm up")
+    except Exception as e:
+        print(e)
+    app.state.redis_client = RedisStore(
+        host=REDIS_HOST, port=REDIS_PORT, compress=CACHE_COMPRESSION
+    )
+    app.state.answer_cache = AnswerCache(
+        app.state.redis_client,
+        app.state.db_client,
+        l1_cache=l1_cache,
+        metrics_dist=metrics_dist,
+    )
+    app.state.retrieval_cache = RetrievalCache(
+        app.state.redis_client.redis,
+        embedding_model=EMBEDDING_MODEL,
+        metrics_dist=metrics_dist,
+    )
+    # reads or downloads the tokenizer, keep it off the event loop
+    await asyncio.to_thread(load_encoding)
+    app.state.context_packer = ContextPacker(
+        default_budget=CONTEXT_TOKEN_BUDGET, budgets=CONTEXT_TOKEN_BUDGETS
+    )
+    admission = AdmissionController(
+        max_concurrency=GENERATION_CONCURRENCY,
+        max_queue=GENERATION_QUEUE_SIZE,
+        concurrency=GENERATION_CONCURRENCY_PER_MODEL,
+        metrics_dist=metrics_dist,
+    )
+    app.state.admission = admission
+    if TELEMETRY_ENABLED:
+        meter.create_observable_gauge(
+            name="admission.queue.size",
+            callbacks=[lambda options: [Observation(admission.queue_size())]],
+            description="Number of generations waiting for a free slot",
+            unit="1",
+        )
+    app.state.single_flight = SingleFlight(
+        app.state.redis_client.redis, certainty=cache_certainty
+    )
+
+    cache_sweeper = CacheSweeper(
+        db_client,
+        app.state.redis_client.redis,
+        ttl_seconds=cache_ttl_seconds,
+        max_entries=CACHE_MAX_ENTRIES,
+        interval=CACHE_SWEEP_INTERVAL,
+        metrics_dist=metrics_dist,
+    )
+    cache_sweeper.start()
+    app.state.cache_sweeper = cache_sweeper
+    if TELEMETRY_ENABLED:
+        meter.create_observable_gauge(
+            name="cache.size",
+            callbacks=[lambda options: [Observation(cache_sweeper.size)]],
+            description="Number of entries in the vector cache collection",
+            unit="1",
+        )
+    app.state.rag_engine = RagEngine(
+        weaviate_client=weaviate.connect_to_local(
+            host=WEAVIATE_HOST, port=(WEAVIATE_PORT)
+        ),
+        embeddings=tei_client,
+        keep_alive=OLLAMA_KEEP_ALIVE,
     )
-    app.state.ollama_client = ollama.Client(host=f"http://{OLLAMA_HOST}:{OLLAMA_PORT}")
-    app.state.redis_client = RedisStore(host=REDIS_HOST, port=REDIS_PORT)
 
 
-def on_shutdown(app: Litestar):
+async def on_shutdown(app: Litestar):
+    cache_sweeper: CacheSweeper = app.state.cache_sweeper
+    await cache_sweeper.close()
+    cache_writer: CacheWriter = app.state.cache_writer
+    await cache_writer.close()
     client: WeaviateStore = app.state.db_client
-    client.close()
-
+    await client.close()
+    single_flight: SingleFlight = app.state.single_flight
+    await single_flight.close()
+    rag_engine: RagEngine = app.state.rag_engine
+    rag_engine.close()
+    ollama_pool: OllamaPool = app.state.ollama_pool
+    await ollama_pool.close()
+    embedding_coalescer: EmbeddingCoalescer = app.state.embedding_coalescer
+    await embedding_coalescer.close()
+    tei_client: TextEmbeddingsInference = app.state.tei_client
+    await tei_client.aclose()
+    redis_client: RedisStore = app.state.redis_client
+    await redis_client.close()
+
+
+async def collect_flight(follower: LocalFollower | RemoteFollower) -> bytes:
+    """Collects the chunks of a generation led by another request into an
+    /llm/invoke response body"""
+    string_buffer = io.StringIO()
+    links_list: list[str] = []
+    async for chunk in follower.subscribe():
+        if "completion" in chunk:
+            string_buffer.write(chunk["completion"])
+        elif "links" in chunk:
+            links_list = chunk["links"]
+    return encode_invoke(string_buffer.getvalue(), links_list)
 
-def create_chain(data: Parameters):
-    """Creates langchain rag chain"""
-    client = weaviate.connect_to_local(host=WEAVIATE_HOST, port=(WEAVIATE_PORT))
-    tei_url = f"http://{TEI_HOST}:{TEI_PORT}"
-    embeddings = TextEmbeddingsInference(url=tei_url, normalize=True)
 
-    db = WeaviateVectorStore(
-        client=client, index_name=collection_name, text_key="text", embedding=embeddings
-    )
-    query_embedding = embeddings.embed_query(data.prompt)
-    retriever = db.as_retriever(
-        search_kwargs=dict(alpha=alpha, k=k, vector=query_embedding)
-    )
+def retrieval_config(langfuse_handler: CallbackHandler | None) -> RunnableConfig:
+    callbacks = [langfuse_handler] if langfuse_handler is not None else []
+    return RunnableConfig(callbacks=callbacks)
 
-    llm = OllamaLLM(
-        base_url=f"http://{OLLAMA_HOST}:{OLLAMA_PORT}",
-        model=data.model,
-        temperature=data.temperature,
-    )
 
-    prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", system_prompt),
-            ("human", "{input}"),
-        ]
+async def retrieve_documents(
+    state: State,
+    data: Parameters,
+    ctx: RetrievalContext,
+    langfuse_handler: CallbackHandler | None,
+) -> list[Document]:
+    """Returns the documents for the prompt from the retrieval cache,
+    running the hybrid search on a miss"""
+    retrieval_cache: RetrievalCache = state.retrieval_cache
+    documents = await retrieval_cache.get(ctx.vector)
+    if documents is not None:
+        return documents
+    rag_engine: RagEngine = state.rag_engine
+    documents = await rag_engine.retrieve(
+        ctx.vector, data.prompt, retrieval_config(langfuse_handler)
     )
-    question_answer_chain = create_stuff_documents_chain(llm, prompt)
-    chain = create_retrieval_chain(retriever, question_answer_chain)
-    return chain
+    await retrieval_cache.store(ctx.vector, documents)
+    return documents
 
 
-def retreive_cache(
-    vec_db_client: WeaviateStore, redis_client: RedisStore, prompt: str
-) -> LlmCompletionSchema | None:
-    """Retrieves cached response if available"""
+async def prepare_generation(
+    state: State,
+    data: Parameters,
+    ctx: RetrievalContext,
+    langfuse_handler: CallbackHandler | None,
+    timer: StageTimer,
+) -> list[Document]:
+    """Retrieves the documents for the prompt while the model is warmed up,
+    then packs them into the context budget of the model"""
+    model_warmer: ModelWarmer = state.model_warmer
+    with timer.stage("retrieval"):
+        documents, _ = await asyncio.gather(
+            retrieve_documents(state, data, ctx, langfuse_handler),
+            model_warmer.warm(data.model),
+        )
+    context_packer: ContextPacker = state.context_packer
+    with timer.stage("packing"):
+        documents, num_context_tokens = context_packer.pack(
+            documents, data.prompt, data.model
+        )
+    if TELEMETRY_ENABLED:
+        histogram_dist["context_tokens"].record(
+            num_context_tokens, attributes={"model": data.model}
+        )
+    return documents
 
-    result = vec_db_client.search_vector_cache(prompt)
-    if len(result) == 0:
-        vec_db_client.insert_vector_cache(prompt)
-        return
 
-    cached_data = redis_client.retrieve_data(result[0])
-    return cached_data
+def speculate(
+    state: State,
+    data: Parameters,
+    ctx: RetrievalContext,
+    langfuse_handler: CallbackHandler | None,
+    timer: StageTimer,
+) -> asyncio.Task | None:
+    """Starts preparing the generation before the semantic cache lookup
+    returns, the task is cancelled when the lookup hits"""
+    if not SPECULATIVE_RETRIEVAL:
+        return None
+    task = asyncio.create_task(
+        prepare_generation(state, data, ctx, langfuse_handler, timer)
+    )
+    # a failure is raised to the request that awaits the task, a task
+    # abandoned on a cache hit should not log it
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return task
 
 
-async def llm_generator(
+async def generate(
     state: State,
     data: Parameters,
+    ctx: RetrievalContext,
     langfuse_handler: CallbackHandler | None,
     metrics_dist: dict[str, Counter],
-) -> AsyncGenerator[bytes, None]:
-    
-    vec_db_client: WeaviateStore = state.db_client
-    redis_client: RedisStore = state.redis_client
+    timer: StageTimer,
+    flight: Flight,
+    ticket: Ticket,
+    speculation: asyncio.Task | None,
+) -> None:
+    """Generates the answer of a flight, publishing queue updates, batches of
+    tokens and the links to every request following it
+
+    Runs in its own task, see SingleFlight.lead. The ticket, the speculation
+    and the flight are released whatever happens.
+    """
+    single_flight: SingleFlight = state.single_flight
+    admission: AdmissionController = state.admission
+    answer_cache: AnswerCache = state.answer_cache
+    error = None
+    try:
+        with timer.stage("queue"):
+            async for position, eta in admission.wait(ticket):
+                await single_flight.publish(
+                    flight, {"queue": {"position": position, "eta": round(eta, 1)}}
+                )
+        # only once admitted, time spent queued must not count against the
+        # pending_ttl after which the sweeper removes abandoned entries
+        await answer_cache.mark_pending(ctx)
+        if speculation is not None:
+            documents = await speculation
+        else:
+            documents = await prepare_generation(
+                state, data, ctx, langfuse_handler, timer
+            )
+        rag_engine: RagEngine = state.rag_engine
+        ollama_pool: OllamaPool = state.ollama_pool
+        endpoints: list[OllamaEndpoint] = []
+        links_list = list({doc.metadata["link"] for doc in documents})
+
+        string_buffer = io.StringIO()
+
+        token_usage = TokenUsageHandler()
+        callbacks = [token_usage]
+        if langfuse_handler is not None:
+            callbacks.append(langfuse_handler)
+        config = RunnableConfig(callbacks=callbacks)
+
+        def answer_tokens(endpoint: OllamaEndpoint) -> AsyncIterator[str]:
+            endpoints.append(endpoint)
+            chain = rag_engine.create_chain(endpoint.url, data.model, data.temperature)
+            return chain.astream(
+                {"input": data.prompt, "context": documents},
+                config=config,
+            )
+
+        # send a frame per batch of tokens instead of one per token
+        with timer.stage("generation"):
+            async for piece in coalesce_tokens(
+                ollama_pool.stream(data.model, answer_tokens),
+                STREAM_FLUSH_INTERVAL_MS / 1000,
+                STREAM_FLUSH_MAX_CHARS,
+            ):
+                if string_buffer.tell() == 0:
+                    timer.since_start("first_token")
+                await single_flight.publish(flight, {"completion": piece})
+                string_buffer.write(piece)
+
+        model_warmer: ModelWarmer = state.model_warmer
+        model_warmer.generated(endpoints[-1], data.model, token_usage.load_duration)
 
-    cached_data = retreive_cache(vec_db_client, redis_client, data.prompt)
-    if cached_data is not None:
         if TELEMETRY_ENABLED:
-            metrics_dist["cache_requests"].add(1)
+            num_input_tokens, num_output_tokens = token_usage.usage()
+            metrics_dist["genai_prompt_tokens"].add(num_input_tokens)
+            metrics_dist["genai_completion_tokens"].add(num_output_tokens)
+            metrics_dist["genai_total_tokens"].add(
+                num_input_tokens + num_output_tokens
+            )
+            metrics_dist["db_requests"].add(1)
+            metrics_dist["genai_requests"].add(1)
 
-        completion: str = cached_data.completion
-        link_list: list[str] = cached_data.links
+        completion = string_buffer.getvalue()
+        await answer_cache.store(ctx, completion, links_list)
 
-        # for token in completion.split():
-        #     yield encode_json({"completion": token})
-        yield encode_json({"completion": completion})
-        yield encode_json({"links": link_list})
+        await single_flight.publish(flight, {"links": links_list})
+    except BaseException as e:
+        error = str(e) or type(e).__name__
+        raise
+    finally:
+        admission.release(ticket)
+        if speculation is not None:
+            speculation.cancel()
+        await single_flight.release(flight, error)
 
-        return
 
-    chain = create_chain(data)
-    link_dict = {}
+async def follow_or_lead(
+    state: State,
+    data: Parameters,
+    ctx: RetrievalContext,
+    langfuse_handler: CallbackHandler | None,
+    metrics_dist: dict[str, Counter],
+    timer: StageTimer,
+    speculation: asyncio.Task | None,
+) -> LocalFollower | RemoteFollower:
+    """Joins the generation of a matching prompt or starts a new one
+
+    A new generation is admitted here, in the request, and then run by
+    generate in a task of its own that takes over the speculation.
+
+    Returns:
+        Follower of the generation answering the prompt
+
+    Raises:
+        AdmissionRejected: when the wait queue of the model is full
+    """
+    single_flight: SingleFlight = state.single_flight
+    flight = await single_flight.acquire(data.prompt, ctx.vector)
+    if not isinstance(flight, Flight):
+        if speculation is not None:
+            speculation.cancel()
+        return flight
+
+    admission: AdmissionController = state.admission
+    try:
+        ticket = admission.enqueue(data.model)
+    except AdmissionRejected as e:
+        if speculation is not None:
+            speculation.cancel()
+        await single_flight.release(flight, str(e))
+        raise
+    return single_flight.lead(
+        flight,
+        generate(
+            state,
+            data,
+            ctx,
+            langfuse_handler,
+            metrics_dist,
+            timer,
+            flight,
+            ticket,
+            speculation,
+        ),
+    )
 
-    num_input_tokens = get_num_tokens(state.ollama_client, data.model, data.prompt)
 
-    if TELEMETRY_ENABLED:
-        metrics_dist["genai_prompt_tokens"].add(num_input_tokens)
+async def llm_generator(
+    state: State,
+    data: Parameters,
+    langfuse_handler: CallbackHandler | None,
+    metrics_dist: dict[str, Counter],
+) -> AsyncGenerator[bytes, None]:
 
-    num_output_tokens = 0
-    completion = ""
-    string_buffer = io.StringIO()
+    timer = StageTimer(histogram_dist.get("request_stage_duration"))
+    answer_cache: AnswerCache = state.answer_cache
+    speculation: asyncio.Task | None = None
 
-    if langfuse_handler is None:
-        config = None
-    else:
-        config = RunnableConfig(callbacks=[langfuse_handler])
-        
-    async for chunk in chain.astream(
-        {"input": data.prompt},
-        config=config,
-    ):
-        if "answer" in chunk:
-            yield encode_json({"completion": chunk["answer"]})
-            num_output_tokens += 1
-            string_buffer.write(chunk["answer"])
-        elif "context" in chunk:
-            link_dict = {
-                "links": list({doc.metadata["link"] for doc in chunk["context"]})
-            }
+    try:
+        with timer.stage("exact_lookup"):
+            cached_data = await answer_cache.lookup_exact(data.prompt)
+        if cached_data is None:
+            with timer.stage("embed"):
+                ctx = await RetrievalContext.create(state.query_embedder, data.prompt)
+            speculation = speculate(state, data, ctx, langfuse_handler, timer)
+            with timer.stage("semantic_lookup"):
+                cached_data = await answer_cache.lookup_semantic(ctx)
+        if cached_data is not None:
+            if TELEMETRY_ENABLED:
+                metrics_dist["cache_requests"].add(1)
 
-    if TELEMETRY_ENABLED:
-        metrics_dist["genai_completion_tokens"].add(num_output_tokens)
-        metrics_dist["genai_total_tokens"].add(num_input_tokens + num_output_tokens)
-        metrics_dist["db_requests"].add(1)
-        metrics_dist["genai_requests"].add(1)
+            yield cached_data.stream
+            return
 
-    completion = string_buffer.getvalue()
-    redis_value = {"completion": completion} | link_dict
-    redis_client.store_data(data.prompt, redis_value)
+        follower = await follow_or_lead(
+            state, data, ctx, langfuse_handler, metrics_dist, timer, speculation
+        )
+        # the speculation now belongs to the generation or was cancelled
+        speculation = None
+        async for chunk in follower.subscribe():
+            yield encode_frame(chunk)
+    finally:
+        if speculation is not None:
+            speculation.cancel()
+
+
+def too_many_requests(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=str(e),
+        headers={"Retry-After": str(math.ceil(e.retry_after))},
+    )
 
-    yield encode_json(link_dict)
+
+async def prepend(
+    first: bytes, rest: AsyncGenerator[bytes, None]
+) -> AsyncGenerator[bytes, None]:
+    try:
+        yield first
+        async for chunk in rest:
+            yield chunk
+    finally:
+        await rest.aclose()
 
 
 @post(
@@ -279,15 +702,22 @@ async def post_llm_stream(
     langfuse_handler: CallbackHandler | None,
     metrics_dist: dict[str, Counter],
 ) -> Stream:
-    return Stream(llm_generator(state, data, langfuse_handler, metrics_dist))
+    generator = llm_generator(state, data, langfuse_handler, metrics_dist)
+    # run until the first frame so a full queue is rejected before the
+    # response starts
+    try:
+        first = await anext(generator)
+    except StopAsyncIteration:
+        first = b""
+    except AdmissionRejected as e:
+        raise too_many_requests(e)
+    return Stream(prepend(first, generator), media_type=STREAM_MEDIA_TYPE)
 
 
 @get("models")
 async def get_models(state: State) -> ModelSchema:
-    client: ollama.Client = state.ollama_client
-    models_req = client.list()
-    choices = [dd.model for dd in models_req.models if dd.model is not None]
-    return ModelSchema(models=choices)
+    ollama_pool: OllamaPool = state.ollama_pool
+    return ModelSchema(models=ollama_pool.list_models())
 
 
 @post(
@@ -303,52 +733,43 @@ async def post_llm(
     data: Parameters,
     langfuse_handler: CallbackHandler | None,
     metrics_dist: dict[str, Counter],
-) -> LlmCompletionSchema:
+) -> Response[bytes]:
+    timer = StageTimer(histogram_dist.get("request_stage_duration"))
+    speculation: asyncio.Task | None = None
     try:
-        vec_db_client: WeaviateStore = state.db_client
-        redis_client: RedisStore = state.redis_client
+        answer_cache: AnswerCache = state.answer_cache
 
-        cached_data = retreive_cache(vec_db_client, redis_client, data.prompt)
+        with timer.stage("exact_lookup"):
+            cached_data = await answer_cache.lookup_exact(data.prompt)
+        if cached_data is None:
+            with timer.stage("embed"):
+                ctx = await RetrievalContext.create(state.query_embedder, data.prompt)
+            speculation = speculate(state, data, ctx, langfuse_handler, timer)
+            with timer.stage("semantic_lookup"):
+                cached_data = await answer_cache.lookup_semantic(ctx)
 
         if cached_data is not None:
             if TELEMETRY_ENABLED:
                 metrics_dist["cache_requests"].add(1)
-            return cached_data
-
-        num_input_tokens = get_num_tokens(state.ollama_client, data.model, data.prompt)
-        chain = create_chain(data)
-
-        if langfuse_handler is None:
-            config = None
-        else:
-            config = RunnableConfig(callbacks=[langfuse_handler])
-        
-        ans = chain.invoke({"input": data.prompt}, config=config)
+            return Response(content=cached_data.invoke, media_type=MediaType.JSON)
 
-        num_output_tokens = get_num_tokens(
-            state.ollama_client, data.model, ans["answer"]
+        follower = await follow_or_lead(
+            state, data, ctx, langfuse_handler, metrics_dist, timer, speculation
+        )
+        # the speculation now belongs to the generation or was cancelled
+        speculation = None
+        return Response(
+            content=await collect_flight(follower), media_type=MediaType.JSON
         )
-        if TELEMETRY_ENABLED:
-            metrics_dist["genai_requests"].add(
-                1,
-            )
-
-            metrics_dist["genai_prompt_tokens"].add(num_input_tokens)
-            metrics_dist["genai_completion_tokens"].add(num_output_tokens)
-
-            metrics_dist["genai_total_tokens"].add(num_input_tokens + num_output_tokens)
-            metrics_dist["db_requests"].add(1)
-
-        links_list = list({doc.metadata["link"] for doc in ans["context"]})
-
-        redis_value = {"completion": ans["answer"], "links": links_list}
-        redis_client.store_data(input_string=data.prompt, value=redis_value)
-
-        return LlmCompletionSchema(completion=ans["answer"], links=links_list)
 
+    except AdmissionRejected as e:
+        raise too_many_requests(e)
     except Exception as e:
         print(e)
         raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        if speculation is not None:
+            speculation.cancel()
 
 
 if TELEMETRY_ENABLED:
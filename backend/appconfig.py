@@ -1,6 +1,21 @@
 import environ
 
 
+def parse_model_values(value: str) -> dict[str, int]:
+    """Parses model=value pairs separated by commas"""
+    values: dict[str, int] = {}
+    for pair in value.split(","):
+        if pair.strip():
+            model, model_value = pair.rsplit("=", 1)
+            values[model.strip()] = int(model_value)
+    return values
+
+
+def parse_list(value: str) -> list[str]:
+    """Parses values separated by commas"""
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
 @environ.config(prefix="")
 class AppConfig:
     ollama_host: str = environ.var(default="localhost")
@@ -9,6 +24,28 @@ class AppConfig:
     weaviate_host: str = environ.var()
     tei_host: str = environ.var()
     tei_port: str = environ.var()
+    tei_batch_size: int = environ.var(default="32", converter=int)
+    tei_max_concurrency: int = environ.var(default="4", converter=int)
+    embedding_cache_dir: str = environ.var(default="")
+    embed_coalesce_window_ms: float = environ.var(default="2", converter=float)
+    embed_coalesce_max_batch: int = environ.var(default="32", converter=int)
+    l1_cache_size: int = environ.var(default="4096", converter=int)
+    cache_flush_interval: float = environ.var(default="1", converter=float)
+    cache_max_entries: int = environ.var(default="100000", converter=int)
+    cache_sweep_interval: float = environ.var(default="300", converter=float)
+    stream_flush_interval_ms: float = environ.var(default="20", converter=float)
+    stream_flush_max_chars: int = environ.var(default="256", converter=int)
+    ollama_urls: list[str] = environ.var(default="", converter=parse_list)
+    ollama_keep_alive: int = environ.var(default="1800", converter=int)
+    context_token_budget: int = environ.var(default="2048", converter=int)
+    context_token_budgets: dict[str, int] = environ.var(
+        default="", converter=parse_model_values
+    )
+    generation_concurrency: int = environ.var(default="2", converter=int)
+    generation_concurrency_per_model: dict[str, int] = environ.var(
+        default="", converter=parse_model_values
+    )
+    generation_queue_size: int = environ.var(default="32", converter=int)
     langfuse_host: str = environ.var(default="localhost")
     langfuse_port: str = environ.var(default="3000")
     langfuse_project_public_key: str = environ.var(default="pk-lf")
@@ -20,6 +57,12 @@ class AppConfig:
     telemetry_enabled = environ.var(
         converter=lambda x: x.casefold() == "True".casefold()
     )
+    cache_compression = environ.var(
+        default="False", converter=lambda x: x.casefold() == "True".casefold()
+    )
+    speculative_retrieval = environ.var(
+        default="True", converter=lambda x: x.casefold() == "True".casefold()
+    )
 
 
 config = environ.to_config(AppConfig)
@@ -0,0 +1,151 @@
+import asyncio
+import datetime
+from typing import Any
+import redis.asyncio as redis
+import weaviate
+from weaviate.classes.query import Filter, Sort
+from constants import cache_collection_name
+from weaviatestore import PENDING
+
+LOCK_KEY = "cache_sweeper_lock"
+
+
+class CacheSweeper:
+    def __init__(
+        self,
+        weaviate_client: weaviate.WeaviateAsyncClient,
+        redis_client: redis.Redis,
+        ttl_seconds: float,
+        max_entries: int,
+        interval: float = 300,
+        pending_ttl: float = 600,
+        batch_size: int = 1000,
+        metrics_dist: dict[str, Any] | None = None,
+    ):
+        """
+        Periodically delete expired, abandoned and over capacity entries
+        from the weaviate cache collection
+
+        Entries expire when last_modified_date is older than ttl_seconds.
+        Pending entries whose generation never finished are removed after
+        pending_ttl. Entries are marked pending once their generation is
+        admitted, so pending_ttl only has to cover the generation itself. When more than max_entries remain, the least recently
+        used ones are deleted. A Redis lock makes sure only one worker
+        sweeps per interval.
+        """
+        self.weaviate_client = weaviate_client
+        self.redis = redis_client
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.interval = interval
+        self.pending_ttl = pending_ttl
+        self.batch_size = batch_size
+        self.metrics_dist = metrics_dist if metrics_dist is not None else {}
+        self.size = 0
+        self._task: asyncio.Task | None = None
+
+    def _record(self, reason: str, count: int) -> None:
+        if count > 0 and "cache_evictions" in self.metrics_dist:
+            self.metrics_dist["cache_evictions"].add(
+                count, attributes={"reason": reason}
+            )
+
+    async def _delete_matching(
+        self, collection, filters, limit: int | None = None
+    ) -> int:
+        """Deletes objects matching filters in batches of batch_size
+
+        Args:
+            collection: weaviate cache collection
+            filters: objects to delete, or None for least recently used ones
+            limit: maximum number of objects to delete
+
+        Returns:
+            Number of deleted objects
+        """
+        deleted = 0
+        while limit is None or deleted < limit:
+            batch_size = self.batch_size
+            if limit is not None:
+                batch_size = min(batch_size, limit - deleted)
+            result = await collection.query.fetch_objects(
+                filters=filters,
+                limit=batch_size,
+                sort=Sort.by_property("last_modified_date", ascending=True),
+                return_properties=[],
+            )
+            ids = [obj.uuid for obj in result.objects]
+            if len(ids) == 0:
+                break
+            response = await collection.data.delete_many(
+                where=Filter.by_id().contains_any(ids)
+            )
+            deleted += response.successful
+            if len(ids) < batch_size or response.successful == 0:
+                break
+        return deleted
+
+    async def sweep(self) -> None:
+        """
+        Run one eviction pass over the cache collection
+        """
+        collection = self.weaviate_client.collections.get(cache_collection_name)
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+        expired = Filter.by_property("last_modified_date").less_than(
+            now - datetime.timedelta(seconds=self.ttl_seconds)
+        )
+        self._record("expired", await self._delete_matching(collection, expired))
+
+        abandoned = Filter.by_property("status").equal(PENDING) & Filter.by_property(
+            "created_on"
+        ).less_than(now - datetime.timedelta(seconds=self.pending_ttl))
+        self._record("abandoned", await self._delete_matching(collection, abandoned))
+
+        await self.refresh_size()
+        excess = self.size - self.max_entries
+        if excess > 0:
+            evicted = await self._delete_matching(collection, None, limit=excess)
+            self._record("capacity", evicted)
+            self.size -= evicted
+
+    async def refresh_size(self) -> None:
+        """
+        Update size with the number of entries in the cache collection
+        """
+        collection = self.weaviate_client.collections.get(cache_collection_name)
+        aggregate = await collection.aggregate.over_all(total_count=True)
+        self.size = aggregate.total_count or 0
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                acquired = await self.redis.set(
+                    LOCK_KEY, "1", nx=True, ex=max(int(self.interval) - 1, 1)
+                )
+                if acquired:
+                    await self.sweep()
+                else:
+                    await self.refresh_size()
+            except Exception as e:
+                print(e)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        """
+        Start the background sweep task
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """
+        Stop the background sweep task
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,209 @@
+import asyncio
+import datetime
+import uuid
+from typing import Any
+import weaviate
+from weaviate.classes.data import DataObject
+from constants import cache_collection_name
+
+
+class CacheWriter:
+    def __init__(
+        self,
+        weaviate_client: weaviate.WeaviateAsyncClient,
+        flush_interval: float = 1.0,
+        max_retries: int = 3,
+        metrics_dist: dict[str, Any] | None = None,
+    ):
+        """
+        Buffer writes to the weaviate cache collection and flush them from
+        a background task, so cache hits and misses only cost a read
+
+        Inserts are sent with one insert_many call per flush, and repeated
+        touches of the same entry collapse into a single update. Writes that
+        fail, for example while weaviate is unreachable, are put back and
+        sent again on the next flushes, at most max_retries times.
+        """
+        self.weaviate_client = weaviate_client
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.metrics_dist = metrics_dist if metrics_dist is not None else {}
+        self._inserts: dict[str, tuple[dict[str, Any], list[float]]] = {}
+        self._updates: dict[str, dict[str, Any]] = {}
+        self._attempts: dict[str, int] = {}
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    def _record(self, op: str, count: int) -> None:
+        if count > 0 and "cache_writes" in self.metrics_dist:
+            self.metrics_dist["cache_writes"].add(count, attributes={"op": op})
+
+    def insert(self, properties: dict[str, Any], vector: list[float]) -> str:
+        """
+        Queue a new cache entry
+
+        Args:
+            properties: properties of the entry
+            vector: embedding of the cached query
+
+        Returns:
+            uuid the entry will be stored under
+        """
+        entry_uuid = str(uuid.uuid4())
+        self._inserts[entry_uuid] = (properties, vector)
+        return entry_uuid
+
+    def update(self, entry_uuid: str, properties: dict[str, Any]) -> None:
+        """
+        Queue a property update, merging it into a queued insert or update
+        of the same entry
+
+        Args:
+            entry_uuid: uuid of the entry
+            properties: properties to change
+        """
+        if entry_uuid in self._inserts:
+            self._inserts[entry_uuid][0].update(properties)
+        else:
+            self._updates.setdefault(entry_uuid, {}).update(properties)
+
+    def touch(self, entry_uuid: str) -> None:
+        """
+        Record a cache hit, refreshing last_modified_date on the next flush
+
+        Args:
+            entry_uuid: uuid of the entry
+        """
+        self.update(
+            entry_uuid,
+            {"last_modified_date": datetime.datetime.now(datetime.timezone.utc)},
+        )
+
+    def _retry(self, entry_uuid: str) -> bool:
+        """
+        Count a failed write of an entry, False once it should be dropped
+        """
+        attempts = self._attempts.get(entry_uuid, 0) + 1
+        if attempts > self.max_retries:
+            print(f"Dropping writes of cache entry {entry_uuid}")
+            self._attempts.pop(entry_uuid, None)
+            return False
+        self._attempts[entry_uuid] = attempts
+        return True
+
+    def _requeue(
+        self,
+        inserts: dict[str, tuple[dict[str, Any], list[float]]],
+        updates: dict[str, dict[str, Any]],
+    ) -> None:
+        """
+        Put writes that could not be sent back into the buffers, changes
+        queued since then win over the older ones
+        """
+        for entry_uuid, (properties, vector) in inserts.items():
+            if self._retry(entry_uuid):
+                newer = self._updates.pop(entry_uuid, {})
+                self._inserts[entry_uuid] = (properties | newer, vector)
+        for entry_uuid, properties in updates.items():
+            if self._retry(entry_uuid):
+                newer = self._updates.get(entry_uuid, {})
+                self._updates[entry_uuid] = properties | newer
+
+    async def delete(self, entry_uuid: str) -> None:
+        """
+        Delete an entry, dropping its queued insert and updates first so a
+        later flush neither brings it back nor fails updating it
+
+        Args:
+            entry_uuid: uuid of the entry
+        """
+        # a flush in progress may be sending the entry, wait for it
+        async with self._lock:
+            self._inserts.pop(entry_uuid, None)
+            self._updates.pop(entry_uuid, None)
+            self._attempts.pop(entry_uuid, None)
+            collection = self.weaviate_client.collections.get(cache_collection_name)
+            await collection.data.delete_by_id(entry_uuid)
+
+    async def flush(self) -> None:
+        """
+        Send every buffered insert and update to weaviate
+        """
+        async with self._lock:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        inserts, self._inserts = self._inserts, {}
+        updates, self._updates = self._updates, {}
+        if not inserts and not updates:
+            return
+
+        collection = self.weaviate_client.collections.get(cache_collection_name)
+        if inserts:
+            uuids = list(inserts)
+            try:
+                result = await collection.data.insert_many(
+                    [
+                        DataObject(
+                            properties=properties, vector=vector, uuid=entry_uuid
+                        )
+                        for entry_uuid, (properties, vector) in inserts.items()
+                    ]
+                )
+            except Exception as e:
+                print(f"Failed to insert {len(inserts)} cache entries: {e}")
+                # updates may refer to the inserts, send them together later
+                self._requeue(inserts, updates)
+                return
+            # rejected objects would be rejected again, they are not retried
+            for idx, error in result.errors.items():
+                print(f"Failed to insert cache entry {uuids[idx]}: {error.message}")
+            for entry_uuid in uuids:
+                self._attempts.pop(entry_uuid, None)
+            self._record("insert", len(inserts) - len(result.errors))
+
+        if updates:
+            results = await asyncio.gather(
+                *(
+                    collection.data.update(uuid=entry_uuid, properties=properties)
+                    for entry_uuid, properties in updates.items()
+                ),
+                return_exceptions=True,
+            )
+            failed: dict[str, dict[str, Any]] = {}
+            for (entry_uuid, properties), r in zip(updates.items(), results):
+                if isinstance(r, Exception):
+                    print(f"Failed to update cache entry {entry_uuid}: {r}")
+                    failed[entry_uuid] = properties
+                else:
+                    self._attempts.pop(entry_uuid, None)
+            self._requeue({}, failed)
+            self._record("update", len(updates) - len(failed))
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(e)
+
+    def start(self) -> None:
+        """
+        Start the background flush task
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """
+        Stop the background flush task and flush what is left
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -1,14 +1,20 @@
+# static instructions come first and per request content last, so every
+# request shares the same prompt prefix and ollama can reuse its KV cache
 system_prompt = """You are an AI assistant for answering questions about the Polars python library.
     You are given the following extracted parts of a long document and a question. Provide a conversational answer.
     If you don't know the answer, just say "Hmm, I'm not sure." Don't try to make up an answer.
     If the question is not about Polars, politely inform them that you are tuned to only answer questions about Polars.
-    Question: {input}
-    =========
+    Answer in Markdown"""
+
+question_prompt = """=========
     {context}
     =========
-    Answer in Markdown"""
+    Question: {input}"""
 
 collection_name = "document_collection"
 cache_collection_name = "cache"
+cache_certainty = 0.95
+cache_ttl_seconds = 24 * 3600
 alpha = 0.5
 k = 4
+retrieval_generation_key = "retrieval_cache:generation"
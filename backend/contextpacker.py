@@ -0,0 +1,114 @@
+import re
+from langchain_core.documents import Document
+from utils import count_tokens_locally
+
+_word = re.compile(r"\w+")
+_passage_separator = re.compile(r"\n\s*\n")
+
+
+class ContextPacker:
+    def __init__(
+        self,
+        default_budget: int = 2048,
+        budgets: dict[str, int] | None = None,
+        min_tokens: int = 32,
+    ):
+        """
+        Fit retrieved documents into a per model token budget before they
+        are stuffed into the prompt
+
+        Documents sharing a link are merged, then added in retrieval order.
+        A document that does not fit is trimmed to the passages around the
+        one sharing the most words with the query. Packing stops once less
+        than min_tokens of the budget remain.
+        """
+        self.default_budget = default_budget
+        self.budgets = budgets if budgets is not None else {}
+        self.min_tokens = min_tokens
+
+    def budget(self, model: str) -> int:
+        """
+        Return the context token budget of model
+        """
+        return self.budgets.get(model, self.default_budget)
+
+    def _dedupe(self, documents: list[Document]) -> list[Document]:
+        merged: dict[str, Document] = {}
+        for doc in documents:
+            link = doc.metadata.get("link", doc.page_content)
+            if link not in merged:
+                merged[link] = Document(
+                    page_content=doc.page_content, metadata=doc.metadata
+                )
+            elif doc.page_content not in merged[link].page_content:
+                merged[link].page_content += "\n\n" + doc.page_content
+        return list(merged.values())
+
+    def _score(self, passage: str, query_words: set[str]) -> float:
+        words = {word.lower() for word in _word.findall(passage)}
+        return len(words & query_words)
+
+    def _truncate(self, text: str, budget: int) -> tuple[str, int]:
+        tokens = count_tokens_locally(text)
+        while tokens > budget and len(text) > 0:
+            text = text[: int(len(text) * budget / tokens)]
+            tokens = count_tokens_locally(text)
+        return text, tokens
+
+    def _trim(self, text: str, query_words: set[str], budget: int) -> tuple[str, int]:
+        """Keeps the best matching passage and as many of its neighbours as
+        fit in budget"""
+        passages = [p for p in _passage_separator.split(text) if p.strip()]
+        if len(passages) == 0:
+            return "", 0
+        counts = [count_tokens_locally(p) for p in passages]
+        best = max(
+            range(len(passages)), key=lambda i: self._score(passages[i], query_words)
+        )
+        if counts[best] > budget:
+            return self._truncate(passages[best], budget)
+
+        lo, hi = best, best + 1
+        used = counts[best]
+        while True:
+            grew = False
+            if hi < len(passages) and used + counts[hi] <= budget:
+                used += counts[hi]
+                hi += 1
+                grew = True
+            if lo > 0 and used + counts[lo - 1] <= budget:
+                lo -= 1
+                used += counts[lo]
+                grew = True
+            if not grew:
+                break
+        return "\n\n".join(passages[lo:hi]), used
+
+    def pack(
+        self, documents: list[Document], query: str, model: str
+    ) -> tuple[list[Document], int]:
+        """Packs documents into the context budget of model
+
+        Args:
+            documents: retrieved documents in rank order
+            query: user prompt
+            model: ollama model used for generation
+
+        Returns:
+            Packed documents and their estimated token count
+        """
+        query_words = {word.lower() for word in _word.findall(query)}
+        remaining = self.budget(model)
+        packed: list[Document] = []
+        for doc in self._dedupe(documents):
+            if remaining < self.min_tokens:
+                break
+            tokens = count_tokens_locally(doc.page_content)
+            content = doc.page_content
+            if tokens > remaining:
+                content, tokens = self._trim(content, query_words, remaining)
+                if tokens == 0:
+                    continue
+            packed.append(Document(page_content=content, metadata=doc.metadata))
+            remaining -= tokens
+        return packed, self.budget(model) - remaining
@@ -0,0 +1,90 @@
+import asyncio
+from typing import Any
+from shared.teiembedding import TextEmbeddingsInference
+
+
+class EmbeddingCoalescer:
+    def __init__(
+        self,
+        tei_client: TextEmbeddingsInference,
+        max_wait_ms: float = 2.0,
+        max_batch_size: int = 32,
+        metrics_dist: dict[str, Any] | None = None,
+    ):
+        """
+        Gather concurrent query embeddings into a single /embed request
+
+        A batch is sent once max_batch_size queries are waiting or
+        max_wait_ms has passed since the first of them arrived.
+        """
+        self.tei_client = tei_client
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.metrics_dist = metrics_dist if metrics_dist is not None else {}
+        self._pending: list[tuple[str, asyncio.Future, float]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def aembed_query(self, text: str) -> list[float]:
+        """
+        Queue text for the next batch and wait for its embedding
+
+        Args:
+            text: The text to embed.
+
+        Returns:
+            Embeddings for the text.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future, loop.time()))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if len(batch) == 0:
+            return
+
+        task = asyncio.create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: list[tuple[str, asyncio.Future, float]]) -> None:
+        sent_at = asyncio.get_running_loop().time()
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+
+        if "embedding_batch_size" in self.metrics_dist:
+            self.metrics_dist["embedding_batch_size"].record(len(texts))
+        if "embedding_batch_wait" in self.metrics_dist:
+            for _, _, queued_at in batch:
+                self.metrics_dist["embedding_batch_wait"].record(
+                    (sent_at - queued_at) * 1000
+                )
+
+        try:
+            vectors = await self.tei_client.aembed_documents(texts)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        vector_map = dict(zip(texts, vectors))
+        for text, future, _ in batch:
+            if not future.done():
+                future.set_result(vector_map[text])
+
+    async def close(self) -> None:
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
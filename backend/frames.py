@@ -0,0 +1,84 @@
+import asyncio
+from typing import AsyncIterator
+import msgspec
+from shared.api_models import LlmCompletionSchema
+
+STREAM_MEDIA_TYPE = "application/x-ndjson"
+
+_json_encoder = msgspec.json.Encoder()
+
+
+def encode_frame(frame: dict) -> bytes:
+    """Encodes one newline delimited frame of the /llm/stream response"""
+    return _json_encoder.encode(frame) + b"\n"
+
+
+def encode_stream(completion: str, links: list[str]) -> bytes:
+    """Encodes a complete answer as the frames of the /llm/stream response"""
+    return encode_frame({"completion": completion}) + encode_frame({"links": links})
+
+
+def encode_invoke(completion: str, links: list[str]) -> bytes:
+    """Encodes a complete answer as the /llm/invoke response body"""
+    return _json_encoder.encode(
+        LlmCompletionSchema(completion=completion, links=links)
+    )
+
+
+async def coalesce_tokens(
+    tokens: AsyncIterator[str], interval: float, max_chars: int
+) -> AsyncIterator[str]:
+    """Merges streamed tokens into larger pieces
+
+    A piece is emitted once it holds max_chars characters or its first token
+    has waited interval seconds, whichever comes first, so slow streams are
+    not delayed by more than interval.
+
+    Args:
+        tokens: tokens produced by the llm
+        interval: longest time in seconds a token is held back
+        max_chars: size at which a piece is emitted immediately
+
+    Returns:
+        Async iterator of merged pieces
+    """
+    loop = asyncio.get_running_loop()
+    iterator = aiter(tokens)
+    buffer: list[str] = []
+    size = 0
+    deadline = 0.0
+    pending: asyncio.Future | None = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(anext(iterator))
+            timeout = max(deadline - loop.time(), 0) if buffer else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                yield "".join(buffer)
+                buffer, size = [], 0
+                continue
+
+            finished, pending = pending, None
+            try:
+                token = finished.result()
+            except StopAsyncIteration:
+                break
+
+            if not buffer:
+                deadline = loop.time() + interval
+            buffer.append(token)
+            size += len(token)
+            if size >= max_chars:
+                yield "".join(buffer)
+                buffer, size = [], 0
+    finally:
+        if pending is not None:
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+    if buffer:
+        yield "".join(buffer)
@@ -0,0 +1,110 @@
+import time
+import numpy as np
+
+
+class L1SemanticCache:
+    def __init__(self, capacity: int = 4096, ttl_seconds: float = 24 * 3600):
+        """
+        In-process semantic cache holding the most recently used query
+        embeddings in a preallocated, normalized float32 matrix
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least one")
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.evictions = 0
+        self._matrix: np.ndarray | None = None
+        self._queries: list[str | None] = [None] * capacity
+        self._uuids: list[str | None] = [None] * capacity
+        self._last_access = np.full(capacity, -np.inf)
+        self._index: dict[str, int] = {}
+
+    def _normalize(self, vector: list[float]) -> np.ndarray:
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec /= norm
+        return vec
+
+    def _expired(self, now: float) -> np.ndarray:
+        return self._last_access < now - self.ttl_seconds
+
+    def size(self) -> int:
+        """
+        Number of entries that have not expired
+        """
+        now = time.monotonic()
+        return int(np.count_nonzero(~self._expired(now)))
+
+    def search(
+        self, vector: list[float], certainty: float
+    ) -> tuple[str, str | None] | None:
+        """
+        Find the closest cached query using a single dot product
+
+        Args:
+            vector: query embedding
+            certainty: minimum weaviate certainty, (1 + cosine) / 2
+
+        Returns:
+            Tuple of cached query and its weaviate uuid, or None on a miss
+        """
+        if self._matrix is None or len(self._index) == 0:
+            return None
+
+        now = time.monotonic()
+        similarities = self._matrix @ self._normalize(vector)
+        similarities[self._expired(now)] = -np.inf
+        slot = int(np.argmax(similarities))
+        if similarities[slot] < 2 * certainty - 1:
+            return None
+
+        self._last_access[slot] = now
+        query = self._queries[slot]
+        assert query is not None
+        return query, self._uuids[slot]
+
+    def insert(self, query: str, vector: list[float], uuid: str | None = None) -> None:
+        """
+        Add or refresh a cached query, evicting the least recently used entry
+        when the cache is full
+
+        Args:
+            query: cached query text
+            vector: query embedding
+            uuid: uuid of the matching object in the weaviate cache collection
+        """
+        vec = self._normalize(vector)
+        if self._matrix is None:
+            self._matrix = np.zeros((self.capacity, vec.shape[0]), dtype=np.float32)
+
+        slot = self._index.get(query)
+        if slot is None:
+            # empty slots sort first, then expired and least recently used ones
+            slot = int(np.argmin(self._last_access))
+            evicted = self._queries[slot]
+            if evicted is not None:
+                del self._index[evicted]
+                self.evictions += 1
+            self._index[query] = slot
+            self._queries[slot] = query
+            self._uuids[slot] = uuid
+        elif uuid is not None:
+            self._uuids[slot] = uuid
+
+        self._matrix[slot] = vec
+        self._last_access[slot] = time.monotonic()
+
+    def remove(self, query: str) -> None:
+        """
+        Drop a cached query, for example when its answer has expired
+
+        Args:
+            query: cached query text
+        """
+        slot = self._index.pop(query, None)
+        if slot is None:
+            return
+        self._queries[slot] = None
+        self._uuids[slot] = None
+        self._last_access[slot] = -np.inf
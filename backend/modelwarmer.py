@@ -0,0 +1,84 @@
+import time
+from typing import Any
+from ollamapool import OllamaEndpoint, OllamaPool
+
+# a model that has to be read from disk takes well over this to load
+COLD_START_SECONDS = 0.5
+
+
+class ModelWarmer:
+    def __init__(
+        self,
+        ollama_pool: OllamaPool,
+        keep_alive: float = 300,
+        metrics_dist: dict[str, Any] | None = None,
+    ):
+        """
+        Ask ollama to load models ahead of generation and keep them loaded
+        for keep_alive seconds
+
+        A model is warmed on the endpoint the pool would route it to, which
+        then prefers that endpoint for the model. It is requested again only
+        once half of keep_alive has passed since it was last warmed there,
+        so warm models cost no extra request.
+        """
+        self.ollama_pool = ollama_pool
+        self.keep_alive = keep_alive
+        self.metrics_dist = metrics_dist if metrics_dist is not None else {}
+        self._warmed: dict[tuple[str, str], float] = {}
+
+    def _record_start(
+        self, model: str, load_duration: int | None, source: str
+    ) -> None:
+        """
+        Count a model start as cold or warm from the load time ollama reports
+        """
+        if load_duration is None or "model_starts" not in self.metrics_dist:
+            return
+        start = "cold" if load_duration / 1e9 >= COLD_START_SECONDS else "warm"
+        self.metrics_dist["model_starts"].add(
+            1, attributes={"model": model, "start": start, "source": source}
+        )
+
+    async def warm(self, model: str) -> None:
+        """
+        Load model into memory without generating anything
+
+        Args:
+            model: ollama model name
+        """
+        now = time.monotonic()
+        endpoint = self.ollama_pool.choose(model)
+        warmed = self._warmed.get((endpoint.url, model), float("-inf"))
+        if now - warmed < self.keep_alive / 2:
+            return
+
+        async def load(endpoint: OllamaEndpoint):
+            # an empty prompt only loads the model
+            response = await endpoint.client.generate(
+                model=model, prompt="", keep_alive=int(self.keep_alive)
+            )
+            # the pool may have failed over from the endpoint chosen above
+            self._warmed[(endpoint.url, model)] = now
+            return response
+
+        try:
+            response = await self.ollama_pool.call(model, load)
+            self._record_start(model, response.load_duration, "warmup")
+        except Exception as e:
+            print(e)
+
+    def generated(
+        self, endpoint: OllamaEndpoint, model: str, load_duration: int | None
+    ) -> None:
+        """
+        Record a finished generation, which also refreshed the keep alive
+        of model on endpoint
+
+        Args:
+            endpoint: endpoint that generated
+            model: ollama model name
+            load_duration: load_duration of the ollama response in nanoseconds
+        """
+        self._warmed[(endpoint.url, model)] = time.monotonic()
+        self._record_start(model, load_duration, "generation")
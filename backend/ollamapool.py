@@ -0,0 +1,222 @@
+import asyncio
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, TypeVar
+import httpx
+import ollama
+
+T = TypeVar("T")
+
+
+class NoHealthyEndpoint(Exception):
+    """Raised when every ollama endpoint failed for a request"""
+
+
+class OllamaEndpoint:
+    """One ollama instance and what the pool knows about it"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.client = ollama.AsyncClient(host=url)
+        self.healthy = True
+        self.outstanding = 0
+        self.loaded_models: set[str] = set()
+        self.available_models: list[str] = []
+
+
+def is_connection_error(e: BaseException) -> bool:
+    """Whether e means the endpoint could not be reached, as opposed to an
+    error in the request itself"""
+    return isinstance(e, (ConnectionError, httpx.TransportError)) or (
+        isinstance(e, ollama.ResponseError) and e.status_code in (502, 503, 504)
+    )
+
+
+class OllamaPool:
+    def __init__(
+        self,
+        urls: list[str],
+        health_interval: float = 10.0,
+        metrics_dist: dict[str, Any] | None = None,
+    ):
+        """
+        Spread generations over several ollama instances
+
+        A request goes to the healthy endpoint with the fewest outstanding
+        requests, preferring endpoints that already have its model loaded.
+        A background task polls every endpoint for health and loaded
+        models. An endpoint that cannot be reached is marked unhealthy and
+        the request is retried on the next one.
+        """
+        if len(urls) == 0:
+            raise ValueError("at least one ollama url is required")
+        self.endpoints = [OllamaEndpoint(url) for url in urls]
+        self.health_interval = health_interval
+        self.metrics_dist = metrics_dist if metrics_dist is not None else {}
+        self._task: asyncio.Task | None = None
+
+    def _record(self, name: str, endpoint: OllamaEndpoint) -> None:
+        if name in self.metrics_dist:
+            self.metrics_dist[name].add(1, attributes={"endpoint": endpoint.url})
+
+    async def _check(self, endpoint: OllamaEndpoint) -> None:
+        try:
+            running, available = await asyncio.gather(
+                endpoint.client.ps(), endpoint.client.list()
+            )
+        except Exception as e:
+            if endpoint.healthy:
+                print(f"ollama endpoint {endpoint.url} is unhealthy: {e}")
+            endpoint.healthy = False
+            return
+        endpoint.healthy = True
+        endpoint.loaded_models = {m.model for m in running.models if m.model}
+        endpoint.available_models = [m.model for m in available.models if m.model]
+
+    async def check(self) -> None:
+        """
+        Refresh health and loaded models of every endpoint
+        """
+        await asyncio.gather(*(self._check(endpoint) for endpoint in self.endpoints))
+
+    def choose(
+        self, model: str, exclude: list[OllamaEndpoint] | None = None
+    ) -> OllamaEndpoint:
+        """Picks the endpoint for a request
+
+        Args:
+            model: ollama model of the request
+            exclude: endpoints that already failed for the request
+
+        Returns:
+            Least loaded healthy endpoint, preferring ones with model loaded
+
+        Raises:
+            NoHealthyEndpoint: when every endpoint is excluded
+        """
+        exclude = exclude if exclude is not None else []
+        candidates = [e for e in self.endpoints if e not in exclude]
+        if len(candidates) == 0:
+            raise NoHealthyEndpoint(f"no ollama endpoint could serve {model}")
+        # endpoints marked unhealthy are still tried when nothing else is left
+        healthy = [e for e in candidates if e.healthy] or candidates
+        loaded = [e for e in healthy if model in e.loaded_models]
+        return min(loaded or healthy, key=lambda e: e.outstanding)
+
+    @contextmanager
+    def lease(self, endpoint: OllamaEndpoint) -> Iterator[None]:
+        """
+        Count a request as outstanding on endpoint while the block runs
+        """
+        endpoint.outstanding += 1
+        try:
+            yield
+        finally:
+            endpoint.outstanding -= 1
+
+    def mark_loaded(self, endpoint: OllamaEndpoint, model: str) -> None:
+        """
+        Note that endpoint served model, so it is loaded there
+        """
+        endpoint.healthy = True
+        endpoint.loaded_models.add(model)
+
+    def _failed(self, endpoint: OllamaEndpoint, e: BaseException) -> None:
+        print(f"ollama endpoint {endpoint.url} failed: {e}")
+        endpoint.healthy = False
+        self._record("ollama_failovers", endpoint)
+
+    async def call(
+        self, model: str, make_call: Callable[[OllamaEndpoint], Awaitable[T]]
+    ) -> T:
+        """Runs a request on the best endpoint, failing over to the others
+
+        Args:
+            model: ollama model of the request
+            make_call: starts the request on the given endpoint
+
+        Returns:
+            Result of the request
+        """
+        tried: list[OllamaEndpoint] = []
+        while True:
+            endpoint = self.choose(model, exclude=tried)
+            try:
+                with self.lease(endpoint):
+                    result = await make_call(endpoint)
+            except Exception as e:
+                if not is_connection_error(e):
+                    raise
+                self._failed(endpoint, e)
+                tried.append(endpoint)
+                continue
+            self.mark_loaded(endpoint, model)
+            return result
+
+    async def stream(
+        self, model: str, make_stream: Callable[[OllamaEndpoint], AsyncIterator[T]]
+    ) -> AsyncIterator[T]:
+        """Streams a request from the best endpoint, failing over to the
+        others until the first item arrives
+
+        Args:
+            model: ollama model of the request
+            make_stream: starts the streaming request on the given endpoint
+
+        Returns:
+            Async iterator of the streamed items
+        """
+        tried: list[OllamaEndpoint] = []
+        while True:
+            endpoint = self.choose(model, exclude=tried)
+            started = False
+            try:
+                with self.lease(endpoint):
+                    async for item in make_stream(endpoint):
+                        started = True
+                        yield item
+            except Exception as e:
+                # text already sent cannot be taken back
+                if started or not is_connection_error(e):
+                    raise
+                self._failed(endpoint, e)
+                tried.append(endpoint)
+                continue
+            self.mark_loaded(endpoint, model)
+            return
+
+    def list_models(self) -> list[str]:
+        """
+        Models available on any healthy endpoint
+        """
+        models: dict[str, None] = {}
+        for endpoint in self.endpoints:
+            if endpoint.healthy:
+                models.update(dict.fromkeys(endpoint.available_models))
+        return list(models)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                await self.check()
+            except Exception as e:
+                print(e)
+
+    def start(self) -> None:
+        """
+        Start the background health check task
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """
+        Stop the background health check task
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,111 @@
+from typing import Any
+from pydantic import BaseModel, ConfigDict, PrivateAttr
+import weaviate
+from langchain_ollama import OllamaLLM
+from langchain_weaviate.vectorstores import WeaviateVectorStore
+from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain_core.documents import Document
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable, RunnableConfig
+from shared.teiembedding import TextEmbeddingsInference
+from constants import system_prompt, question_prompt, collection_name, alpha, k
+
+
+def build_prompt() -> ChatPromptTemplate:
+    """Assembles the generation prompt with the static system instructions
+    first and the retrieved context and question last
+
+    Returns:
+        Prompt template taking context and input
+    """
+    return ChatPromptTemplate.from_messages(
+        [
+            ("system", system_prompt),
+            ("human", question_prompt),
+        ]
+    )
+
+
+class RagEngine(BaseModel):
+    """Long lived retrieval and generation engine shared by all requests"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+    weaviate_client: weaviate.WeaviateClient
+    embeddings: TextEmbeddingsInference
+    keep_alive: int | None = None
+    """Seconds ollama keeps a model loaded after a generation"""
+
+    _vector_store: WeaviateVectorStore = PrivateAttr()
+    _prompt: ChatPromptTemplate = PrivateAttr()
+    _llms: dict[tuple[str, str], OllamaLLM] = PrivateAttr(default_factory=dict)
+
+    def model_post_init(self, context: Any) -> None:
+        self._vector_store = WeaviateVectorStore(
+            client=self.weaviate_client,
+            index_name=collection_name,
+            text_key="text",
+            embedding=self.embeddings,
+        )
+        self._prompt = build_prompt()
+
+    def _get_llm(self, ollama_url: str, model: str) -> OllamaLLM:
+        """Returns the llm for an ollama instance and model, creating it on
+        first use so its ollama client is reused afterwards
+
+        Temperature is not part of the key, it comes from the request and
+        is passed with every call instead.
+        """
+        key = (ollama_url, model)
+        if key not in self._llms:
+            self._llms[key] = OllamaLLM(
+                base_url=ollama_url,
+                model=model,
+                keep_alive=self.keep_alive,
+            )
+        return self._llms[key]
+
+    async def retrieve(
+        self,
+        query_embedding: list[float],
+        prompt: str,
+        config: RunnableConfig | None = None,
+    ) -> list[Document]:
+        """Runs the hybrid search for a prompt
+
+        Retrieval is separate from generation so it can start before the
+        answer cache lookup finishes.
+
+        Args:
+            query_embedding: embedding of the user prompt
+            prompt: user prompt
+            config: runnable config passed to the retriever
+
+        Returns:
+            Retrieved documents
+        """
+        retriever = self._vector_store.as_retriever(
+            search_kwargs=dict(alpha=alpha, k=k, vector=query_embedding)
+        )
+        return await retriever.ainvoke(prompt, config=config)
+
+    def create_chain(
+        self, ollama_url: str, model: str, temperature: float
+    ) -> Runnable:
+        """Creates langchain chain answering from retrieved documents
+
+        Args:
+            ollama_url: url of the ollama instance that generates
+            model: ollama model used for generation
+            temperature: sampling temperature
+
+        Returns:
+            Stuff documents chain taking input and context, using the
+            shared llm
+        """
+        llm = self._get_llm(ollama_url, model)
+        # options replace the sampling fields of the llm, none of which are set
+        bound = llm.bind(options={"temperature": temperature})
+        return create_stuff_documents_chain(bound, self._prompt)
+
+    def close(self):
+        self.weaviate_client.close()
@@ -1,14 +1,69 @@
 import hashlib
-import redis
+import time
+from collections import OrderedDict
+import redis.asyncio as redis
 import msgspec
-from shared.api_models import LlmCompletionSchema
+from constants import cache_ttl_seconds
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# bumped whenever the stored frame format changes, older values read as misses
+RAW_PREFIX = b"\x02"
+ZSTD_PREFIX = b"\x03"
+
+
+class CachedResponse(msgspec.Struct, array_like=True):
+    """Ready to send response bodies of a cached answer"""
+
+    stream: bytes
+    invoke: bytes
+    uuid: str | None = None
+    """uuid of the semantic entry of the answer, values written before it
+    existed decode with None"""
+
 
 class RedisStore:
-    def __init__(self, host="localhost", port=6379, db=0, password=None):
+    def __init__(
+        self,
+        host="localhost",
+        port=6379,
+        db=0,
+        password=None,
+        ttl_seconds: int = cache_ttl_seconds,
+        recent_maxsize: int = 1024,
+        recent_ttl: int = 60,
+        compress: bool = False,
+        max_connections: int = 64,
+    ):
         """
-        Initialize Redis connection
+        Initialize async Redis connection pool and the in-process LRU of
+        recently seen keys
         """
-        self.redis = redis.Redis(host=host, port=port, db=db, password=password)
+        self.redis = redis.Redis(
+            host=host,
+            port=port,
+            db=db,
+            password=password,
+            max_connections=max_connections,
+        )
+        self.ttl_seconds = ttl_seconds
+        self.recent_maxsize = recent_maxsize
+        self.recent_ttl = recent_ttl
+        self._recent: OrderedDict[str, tuple[float, CachedResponse]] = OrderedDict()
+        self._encoder = msgspec.msgpack.Encoder()
+        self._decoder = msgspec.msgpack.Decoder(type=CachedResponse)
+        self._compressor = None
+        self._decompressor = None
+        if compress and zstandard is None:
+            raise ValueError("zstandard is required for cache compression")
+        if zstandard is not None:
+            # values written compressed by other workers stay readable
+            self._decompressor = zstandard.ZstdDecompressor()
+            if compress:
+                self._compressor = zstandard.ZstdCompressor()
 
     def _get_key_hash(self, input_string: str) -> str:
         """
@@ -16,29 +71,80 @@ class RedisStore:
         """
         return hashlib.sha256(input_string.encode("utf-8")).hexdigest()
 
-    def store_data(
-        self, input_string: str, value: dict, expiration_seconds: int = 3600
+    def _remember(self, key: str, value: CachedResponse, ttl: int) -> None:
+        """
+        Keep value in the in-process LRU for at most ttl seconds
+        """
+        self._recent[key] = (time.monotonic() + ttl, value)
+        self._recent.move_to_end(key)
+        if len(self._recent) > self.recent_maxsize:
+            self._recent.popitem(last=False)
+
+    def _recall(self, key: str) -> CachedResponse | None:
+        """
+        Return value from the in-process LRU if present and not expired
+        """
+        entry = self._recent.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._recent[key]
+            return None
+        self._recent.move_to_end(key)
+        return value
+
+    def _encode(self, value: CachedResponse) -> bytes:
+        """
+        Serialize a cached response, compressing it when enabled
+        """
+        payload = self._encoder.encode(value)
+        if self._compressor is not None:
+            return ZSTD_PREFIX + self._compressor.compress(payload)
+        return RAW_PREFIX + payload
+
+    def _decode(self, value: bytes) -> CachedResponse | None:
+        """
+        Deserialize a cached response, or None for values in another format
+        """
+        prefix, payload = value[:1], value[1:]
+        try:
+            if prefix == ZSTD_PREFIX and self._decompressor is not None:
+                payload = self._decompressor.decompress(payload)
+            elif prefix != RAW_PREFIX:
+                return None
+            return self._decoder.decode(payload)
+        except (msgspec.DecodeError, ValueError):
+            return None
+
+    async def store_data(
+        self,
+        input_string: str,
+        value: CachedResponse,
+        expiration_seconds: int | None = None,
     ) -> str:
         """
         Store data in Redis with hashed key and expiration time
 
         Args:
             input_string: The string to hash for the key
-            value: The value to store (will be converted to string)
-            expiration_seconds: Time to live in seconds (default 1 hour)
+            value: The pre-encoded responses to store
+            expiration_seconds: Time to live in seconds (default ttl_seconds)
 
         Returns:
             The hashed key used for storage
         """
+        if expiration_seconds is None:
+            expiration_seconds = self.ttl_seconds
         key = self._get_key_hash(input_string)
-        encoder = msgspec.msgpack.Encoder()
-        redis_value = encoder.encode(value)
-        self.redis.setex(key, expiration_seconds, redis_value)
+        await self.redis.setex(key, expiration_seconds, self._encode(value))
+        self._remember(key, value, min(expiration_seconds, self.recent_ttl))
         return key
 
-    def retrieve_data(self, input_string: str) -> LlmCompletionSchema:
+    async def retrieve_exact(self, input_string: str) -> CachedResponse | None:
         """
-        Retrieve data from Redis using the hashed key
+        Look up the exact input string, first in the in-process LRU and then
+        in Redis, without any embedding or vector search
 
         Args:
             input_string: The original string used to generate the key
@@ -47,12 +153,36 @@ class RedisStore:
             The stored value or None if not found/expired
         """
         key = self._get_key_hash(input_string)
-        value = self.redis.get(key)
-        decoder = msgspec.msgpack.Decoder(type=LlmCompletionSchema)
-        
+        cached_response = self._recall(key)
+        if cached_response is not None:
+            return cached_response
+
+        cached_response = await self.retrieve_data(input_string)
+        if cached_response is not None:
+            self._remember(key, cached_response, self.recent_ttl)
+        return cached_response
+
+    async def retrieve_data(self, input_string: str) -> CachedResponse | None:
+        """
+        Retrieve data from Redis using the hashed key, resetting its time to
+        live so it slides like the vector cache last_modified_date. GETEX
+        reads and touches the key in a single round trip.
+
+        Args:
+            input_string: The original string used to generate the key
+
+        Returns:
+            The stored value or None if not found/expired
+        """
+        key = self._get_key_hash(input_string)
+        value = await self.redis.getex(key, ex=self.ttl_seconds)
         if value is None:
-            raise ValueError(f"key is missing {input_string}")
+            return None
         assert isinstance(value, bytes)
+        return self._decode(value)
 
-        llm_completion = decoder.decode(value)
-        return llm_completion
+    async def close(self) -> None:
+        """
+        Close the Redis connection pool
+        """
+        await self.redis.aclose()
@@ -0,0 +1,109 @@
+import hashlib
+import time
+from typing import Any
+import msgspec
+import numpy as np
+import redis.asyncio as redis
+from langchain_core.documents import Document
+from constants import alpha, k, cache_ttl_seconds, retrieval_generation_key
+
+
+class CachedDocument(msgspec.Struct, array_like=True):
+    page_content: str
+    metadata: dict[str, Any]
+
+
+class RetrievalCache:
+    def __init__(
+        self,
+        redis_client: redis.Redis,
+        embedding_model: str,
+        ttl_seconds: int = cache_ttl_seconds,
+        scale: float = 64,
+        generation_refresh: float = 5.0,
+        metrics_dist: dict[str, Any] | None = None,
+    ):
+        """
+        Cache of hybrid search results keyed by the quantized query
+        embedding, alpha and k
+
+        Results do not depend on the llm or temperature, so every model
+        shares them. Embedding components are rounded to multiples of
+        1 / scale, so only near identical queries share an entry. Keys
+        include the index generation the loader bumps after re-indexing,
+        which invalidates every older entry at once.
+        """
+        self.redis = redis_client
+        self.embedding_model = embedding_model
+        self.ttl_seconds = ttl_seconds
+        self.scale = scale
+        self.generation_refresh = generation_refresh
+        self.metrics_dist = metrics_dist if metrics_dist is not None else {}
+        self._generation = b"0"
+        self._generation_checked = float("-inf")
+        self._encoder = msgspec.msgpack.Encoder(enc_hook=str)
+        self._decoder = msgspec.msgpack.Decoder(type=list[CachedDocument])
+
+    def _record(self, result: str) -> None:
+        if "cache_lookups" in self.metrics_dist:
+            self.metrics_dist["cache_lookups"].add(
+                1, attributes={"tier": "retrieval", "result": result}
+            )
+
+    async def _current_generation(self) -> bytes:
+        """
+        Return the index generation, reading it from Redis at most once
+        per generation_refresh seconds
+        """
+        now = time.monotonic()
+        if now - self._generation_checked >= self.generation_refresh:
+            generation = await self.redis.get(retrieval_generation_key)
+            self._generation = generation if generation is not None else b"0"
+            self._generation_checked = now
+        return self._generation
+
+    async def _get_key(self, vector: list[float]) -> str:
+        quantized = np.round(np.asarray(vector, dtype=np.float32) * self.scale)
+        digest = hashlib.sha256(quantized.astype(np.int16).tobytes())
+        digest.update(f"{self.embedding_model}:{alpha}:{k}".encode("utf-8"))
+        generation = (await self._current_generation()).decode()
+        return f"retrieval:{generation}:{digest.hexdigest()}"
+
+    async def get(self, vector: list[float]) -> list[Document] | None:
+        """Looks up the documents retrieved for a query embedding
+
+        Args:
+            vector: embedding of the user prompt
+
+        Returns:
+            Retrieved documents or None on a miss
+        """
+        value = await self.redis.get(await self._get_key(vector))
+        if value is None:
+            self._record("miss")
+            return None
+        try:
+            cached = self._decoder.decode(value)
+        except msgspec.DecodeError:
+            self._record("miss")
+            return None
+        self._record("hit")
+        return [
+            Document(page_content=doc.page_content, metadata=doc.metadata)
+            for doc in cached
+        ]
+
+    async def store(self, vector: list[float], documents: list[Document]) -> None:
+        """Stores the documents retrieved for a query embedding
+
+        Args:
+            vector: embedding of the user prompt
+            documents: retrieved documents
+        """
+        value = self._encoder.encode(
+            [
+                CachedDocument(page_content=doc.page_content, metadata=doc.metadata)
+                for doc in documents
+            ]
+        )
+        await self.redis.setex(await self._get_key(vector), self.ttl_seconds, value)
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from pydantic import BaseModel
+from shared.teiembedding import TextEmbeddingsInference
+from embeddingcoalescer import EmbeddingCoalescer
+
+
+class QueryEmbedder:
+    def __init__(
+        self,
+        tei_client: TextEmbeddingsInference | EmbeddingCoalescer,
+        maxsize: int = 1024,
+    ):
+        """
+        Embed prompts with a bounded LRU of prompt to vector
+        """
+        self.tei_client = tei_client
+        self.maxsize = maxsize
+        self._cache: OrderedDict[str, list[float]] = OrderedDict()
+
+    async def embed(self, prompt: str) -> list[float]:
+        """
+        Return the embedding of prompt, calling TEI only on an LRU miss
+
+        Args:
+            prompt: text to embed
+
+        Returns:
+            Embedding vector of the prompt
+        """
+        vec = self._cache.get(prompt)
+        if vec is not None:
+            self._cache.move_to_end(prompt)
+            return vec
+
+        vec = await self.tei_client.aembed_query(prompt)
+        self._cache[prompt] = vec
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return vec
+
+
+class RetrievalContext(BaseModel):
+    """Request scoped state shared by cache lookup, cache insert and retrieval"""
+
+    prompt: str
+    vector: list[float]
+    cache_uuid: str | None = None
+    """uuid of the pending vector cache entry created for this prompt"""
+
+    @classmethod
+    async def create(cls, embedder: QueryEmbedder, prompt: str) -> "RetrievalContext":
+        """Embeds the prompt once and wraps it in a retrieval context
+
+        Args:
+            embedder: query embedder
+            prompt: user prompt
+
+        Returns:
+            Retrieval context for the request
+        """
+        vector = await embedder.embed(prompt)
+        return cls(prompt=prompt, vector=vector)
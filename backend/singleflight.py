@@ -0,0 +1,284 @@
+import asyncio
+import hashlib
+import os
+import uuid
+from typing import Any, AsyncIterator, Coroutine
+import msgspec
+import numpy as np
+import redis.asyncio as redis
+
+
+class SingleFlightError(Exception):
+    """Raised to followers when the generation they subscribed to fails"""
+
+
+class FlightMessage(msgspec.Struct):
+    seq: int
+    chunk: dict[str, Any] | None = None
+    done: bool = False
+    error: str | None = None
+
+
+class Flight:
+    """A generation running on this worker that followers can subscribe to"""
+
+    is_leader = True
+
+    def __init__(self, key: str, vector: np.ndarray | None):
+        self.key = key
+        self.vector = vector
+        self.chunks: list[dict[str, Any]] = []
+        self.done = False
+        self.error: str | None = None
+        self._changed = asyncio.Event()
+        self._renewal: asyncio.Task | None = None
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator[dict[str, Any]]:
+        """Replays the chunks produced so far and then follows new ones"""
+        idx = 0
+        while True:
+            while idx < len(self.chunks):
+                yield self.chunks[idx]
+                idx += 1
+            if self.done:
+                if self.error is not None:
+                    raise SingleFlightError(self.error)
+                return
+            await self._changed.wait()
+
+
+class LocalFollower:
+    """Follower of a generation led by this worker"""
+
+    is_leader = False
+
+    def __init__(self, flight: Flight):
+        self.flight = flight
+
+    def subscribe(self) -> AsyncIterator[dict[str, Any]]:
+        return self.flight.subscribe()
+
+
+class RemoteFollower:
+    """Follower of a generation led by another worker, relayed through Redis"""
+
+    is_leader = False
+
+    def __init__(self, single_flight: "SingleFlight", key: str):
+        self.single_flight = single_flight
+        self.key = key
+
+    def subscribe(self) -> AsyncIterator[dict[str, Any]]:
+        return self.single_flight._follow_remote(self.key)
+
+
+class SingleFlight:
+    def __init__(
+        self,
+        redis_client: redis.Redis,
+        certainty: float,
+        claim_ttl: int = 300,
+        replay_ttl: int = 30,
+        poll_interval: float = 5.0,
+    ):
+        """
+        Deduplicate generations of identical or near identical prompts
+
+        The first request for a prompt leads and generates, later requests
+        subscribe to its chunks. Prompts are matched by hash across workers
+        through Redis pub/sub, and semantically within this worker. The
+        leader claim expires after claim_ttl seconds unless renewed, which
+        the leader does while it waits for admission and generates.
+        """
+        self.redis = redis_client
+        self.certainty = certainty
+        self.claim_ttl = claim_ttl
+        self.replay_ttl = replay_ttl
+        self.poll_interval = poll_interval
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._flights: dict[str, Flight] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._encoder = msgspec.msgpack.Encoder()
+        self._decoder = msgspec.msgpack.Decoder(type=FlightMessage)
+
+    def _get_key_hash(self, prompt: str) -> str:
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    def _channel(self, key: str) -> str:
+        return f"singleflight:{key}"
+
+    def _normalize(self, vector: list[float] | None) -> np.ndarray | None:
+        if vector is None:
+            return None
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def _find_local(self, key: str, vector: np.ndarray | None) -> Flight | None:
+        flight = self._flights.get(key)
+        if flight is not None or vector is None:
+            return flight
+        min_similarity = 2 * self.certainty - 1
+        for flight in self._flights.values():
+            if flight.vector is None:
+                continue
+            if float(flight.vector @ vector) >= min_similarity:
+                return flight
+        return None
+
+    async def acquire(
+        self, prompt: str, vector: list[float] | None = None
+    ) -> Flight | LocalFollower | RemoteFollower:
+        """Joins a matching in-flight generation or becomes its leader
+
+        Args:
+            prompt: user prompt
+            vector: embedding of the prompt, used for semantic matching
+
+        Returns:
+            Flight when the caller should generate, otherwise a follower
+        """
+        key = self._get_key_hash(prompt)
+        normalized = self._normalize(vector)
+
+        flight = self._find_local(key, normalized)
+        if flight is not None:
+            return LocalFollower(flight)
+
+        claimed = await self.redis.set(
+            f"{self._channel(key)}:leader", self.worker_id, nx=True, ex=self.claim_ttl
+        )
+        if not claimed:
+            return RemoteFollower(self, key)
+
+        # drop the replay log of an earlier generation of the same prompt
+        await self.redis.delete(f"{self._channel(key)}:chunks")
+        flight = Flight(key, normalized)
+        flight._renewal = asyncio.create_task(self._renew(key))
+        self._flights[key] = flight
+        return flight
+
+    async def _renew(self, key: str) -> None:
+        """
+        Keep the leader claim and the replay log alive, also when nothing
+        is published for a while
+        """
+        channel = self._channel(key)
+        while True:
+            await asyncio.sleep(self.claim_ttl / 3)
+            try:
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    pipe.expire(f"{channel}:leader", self.claim_ttl)
+                    pipe.expire(f"{channel}:chunks", self.replay_ttl + self.claim_ttl)
+                    await pipe.execute()
+            except Exception as e:
+                print(e)
+
+    def lead(
+        self, flight: Flight, generation: Coroutine[Any, Any, None]
+    ) -> LocalFollower:
+        """Runs the generation of a flight in a task of its own
+
+        The generation does not belong to the request that started it, so
+        it keeps going for the followers when that request disconnects. It
+        must publish its chunks and release the flight.
+
+        Args:
+            flight: flight returned by acquire
+            generation: coroutine producing the chunks of the flight
+
+        Returns:
+            Follower through which the leading request reads the chunks
+        """
+        task = asyncio.create_task(generation)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        # failures reach the followers through the flight
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return LocalFollower(flight)
+
+    async def close(self) -> None:
+        """
+        Cancel the generations still running
+        """
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def publish(self, flight: Flight, chunk: dict[str, Any]) -> None:
+        """Sends a chunk produced by the leader to every follower"""
+        flight.chunks.append(chunk)
+        flight._notify()
+        await self._send(flight.key, FlightMessage(seq=len(flight.chunks), chunk=chunk))
+
+    async def release(self, flight: Flight, error: str | None = None) -> None:
+        """Marks the generation as finished and gives up leadership"""
+        flight.done = True
+        flight.error = error
+        flight._notify()
+        self._flights.pop(flight.key, None)
+        if flight._renewal is not None:
+            flight._renewal.cancel()
+
+        channel = self._channel(flight.key)
+        await self._send(
+            flight.key,
+            FlightMessage(seq=len(flight.chunks) + 1, done=True, error=error),
+        )
+        await self.redis.expire(f"{channel}:chunks", self.replay_ttl)
+        await self.redis.delete(f"{channel}:leader")
+
+    async def _send(self, key: str, message: FlightMessage) -> None:
+        channel = self._channel(key)
+        payload = self._encoder.encode(message)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(f"{channel}:chunks", payload)
+            pipe.expire(f"{channel}:chunks", self.replay_ttl + self.claim_ttl)
+            pipe.expire(f"{channel}:leader", self.claim_ttl)
+            pipe.publish(channel, payload)
+            await pipe.execute()
+
+    async def _follow_remote(self, key: str) -> AsyncIterator[dict[str, Any]]:
+        channel = self._channel(key)
+        pubsub = self.redis.pubsub()
+        await pubsub.subscribe(channel)
+        try:
+            # replay what was published before we subscribed
+            seq = 0
+            for raw in await self.redis.lrange(f"{channel}:chunks", 0, -1):
+                message = self._decoder.decode(raw)
+                if message.seq <= seq:
+                    continue
+                seq = message.seq
+                if message.done:
+                    if message.error is not None:
+                        raise SingleFlightError(message.error)
+                    return
+                assert message.chunk is not None
+                yield message.chunk
+
+            while True:
+                raw = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=self.poll_interval
+                )
+                if raw is None:
+                    if not await self.redis.exists(f"{channel}:leader"):
+                        raise SingleFlightError("leader stopped before finishing")
+                    continue
+                message = self._decoder.decode(raw["data"])
+                if message.seq <= seq:
+                    continue
+                seq = message.seq
+                if message.done:
+                    if message.error is not None:
+                        raise SingleFlightError(message.error)
+                    return
+                assert message.chunk is not None
+                yield message.chunk
+        finally:
+            await pubsub.unsubscribe(channel)
+            await pubsub.aclose()
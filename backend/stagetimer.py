@@ -0,0 +1,37 @@
+import time
+from contextlib import contextmanager
+from typing import Iterator
+from opentelemetry.metrics._internal.instrument import Histogram
+
+
+class StageTimer:
+    def __init__(self, histogram: Histogram | None = None):
+        """
+        Record how long each stage of a request takes, in milliseconds,
+        with the stage name as attribute
+        """
+        self.histogram = histogram
+        self.start = time.perf_counter()
+
+    def _record(self, stage: str, started: float) -> None:
+        if self.histogram is not None:
+            self.histogram.record(
+                (time.perf_counter() - started) * 1000, attributes={"stage": stage}
+            )
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        """
+        Time the enclosed block as stage
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(stage, started)
+
+    def since_start(self, stage: str) -> None:
+        """
+        Record the time elapsed since the request started as stage
+        """
+        self._record(stage, self.start)
@@ -0,0 +1,23 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# backend modules are imported by name, as when the server runs from backend/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from stubollama import StubOllama  # noqa: E402
+
+
+@pytest.fixture
+def stubs():
+    servers: list[StubOllama] = []
+
+    def start(**kwargs) -> StubOllama:
+        server = StubOllama(**kwargs)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
@@ -0,0 +1,94 @@
+"""Local HTTP server standing in for ollama in tests"""
+
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+MODEL = "gemma2:2b"
+
+
+class StubOllama:
+    """Local HTTP server answering the ollama endpoints the pool uses"""
+
+    def __init__(
+        self,
+        loaded: tuple[str, ...] = (),
+        tokens: tuple[str, ...] = ("Hello", " world"),
+        status: int = 200,
+        drop_after_first_token: bool = False,
+    ):
+        self.generate_calls = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, body: dict) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_chunk(self, body: dict) -> None:
+                data = json.dumps(body).encode() + b"\n"
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_GET(self):
+                models = [{"model": m, "name": m} for m in loaded]
+                if self.path == "/api/ps":
+                    self._send_json(200, {"models": models})
+                elif self.path == "/api/tags":
+                    self._send_json(200, {"models": models})
+                else:
+                    self._send_json(404, {"error": "not found"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length))
+                stub.generate_calls += 1
+                if status != 200:
+                    self._send_json(status, {"error": "unavailable"})
+                    return
+                if not request.get("stream", True):
+                    self._send_json(
+                        200,
+                        {"model": MODEL, "response": "".join(tokens), "done": True},
+                    )
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for token in tokens:
+                    self._send_chunk({"model": MODEL, "response": token, "done": False})
+                    if drop_after_first_token:
+                        # end the connection in the middle of the response
+                        self.close_connection = True
+                        return
+                self._send_chunk({"model": MODEL, "response": "", "done": True})
+                self.wfile.write(b"0\r\n\r\n")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def closed_url() -> str:
+    """Url of a local port nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
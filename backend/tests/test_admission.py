@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+MODEL = "gemma2:2b"
+
+
+async def next_update(controller: AdmissionController, ticket) -> tuple[int, float]:
+    return await anext(controller.wait(ticket))
+
+
+def test_admits_up_to_the_limit_and_queues_in_order():
+    async def run():
+        controller = AdmissionController(max_concurrency=2, initial_duration=10)
+        running = [controller.enqueue(MODEL) for _ in range(2)]
+        waiting = [controller.enqueue(MODEL) for _ in range(3)]
+
+        assert all(t.admitted for t in running)
+        assert not any(t.admitted for t in waiting)
+        assert controller.queue_size() == 3
+        # two run at once, so the third waiter needs two rounds
+        assert await next_update(controller, waiting[0]) == (1, 10)
+        assert await next_update(controller, waiting[1]) == (2, 10)
+        assert await next_update(controller, waiting[2]) == (3, 20)
+
+        controller.release(running[0])
+        assert waiting[0].admitted and not waiting[1].admitted
+        assert controller.position(waiting[1]) == 1
+        assert controller.queue_size() == 2
+
+    asyncio.run(run())
+
+
+def test_wait_follows_the_queue_until_admitted():
+    async def run():
+        controller = AdmissionController(max_concurrency=1)
+        running = controller.enqueue(MODEL)
+        first = controller.enqueue(MODEL)
+        second = controller.enqueue(MODEL)
+
+        async def positions():
+            return [position async for position, _ in controller.wait(second)]
+
+        task = asyncio.create_task(positions())
+        await asyncio.sleep(0)
+        controller.release(running)
+        await asyncio.sleep(0)
+        controller.release(first)
+        assert await asyncio.wait_for(task, 1) == [2, 1]
+        assert second.admitted
+
+    asyncio.run(run())
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    async def run():
+        controller = AdmissionController(
+            max_concurrency=2, max_queue=3, initial_duration=10
+        )
+        for _ in range(5):
+            controller.enqueue(MODEL)
+
+        with pytest.raises(AdmissionRejected) as rejected:
+            controller.enqueue(MODEL)
+        # fourth in line behind two running generations
+        assert rejected.value.retry_after == 20
+        assert rejected.value.model == MODEL
+        assert controller.queue_size() == 3
+
+    asyncio.run(run())
+
+
+def test_leaving_the_queue_moves_the_others_up():
+    async def run():
+        controller = AdmissionController(max_concurrency=1)
+        controller.enqueue(MODEL)
+        leaving = controller.enqueue(MODEL)
+        staying = controller.enqueue(MODEL)
+
+        controller.release(leaving)
+        assert controller.position(staying) == 1
+        assert controller.queue_size() == 1
+
+    asyncio.run(run())
+
+
+def test_limits_are_per_model():
+    async def run():
+        controller = AdmissionController(
+            max_concurrency=1, concurrency={"large": 2}
+        )
+        assert controller.enqueue("small").admitted
+        assert not controller.enqueue("small").admitted
+        assert controller.enqueue("large").admitted
+        assert controller.enqueue("large").admitted
+        assert not controller.enqueue("large").admitted
+
+    asyncio.run(run())
@@ -0,0 +1,28 @@
+import asyncio
+
+from modelwarmer import ModelWarmer
+from ollamapool import OllamaPool
+from stubollama import MODEL, closed_url
+
+
+def test_warm_marks_the_endpoint_that_loaded_the_model(stubs):
+    healthy = stubs()
+    dead = closed_url()
+    warmer = ModelWarmer(OllamaPool([dead, healthy.url]))
+
+    asyncio.run(warmer.warm(MODEL))
+    assert (healthy.url, MODEL) in warmer._warmed
+    assert (dead, MODEL) not in warmer._warmed
+    assert healthy.generate_calls == 1
+
+
+def test_warm_model_is_not_requested_again(stubs):
+    healthy = stubs()
+    warmer = ModelWarmer(OllamaPool([healthy.url]))
+
+    async def run():
+        await warmer.warm(MODEL)
+        await warmer.warm(MODEL)
+
+    asyncio.run(run())
+    assert healthy.generate_calls == 1
@@ -0,0 +1,85 @@
+import asyncio
+
+import httpx
+import pytest
+
+from ollamapool import OllamaEndpoint, OllamaPool
+from stubollama import MODEL, closed_url
+
+
+async def generate_tokens(endpoint: OllamaEndpoint):
+    stream = await endpoint.client.generate(model=MODEL, prompt="hi", stream=True)
+    async for part in stream:
+        if part.response:
+            yield part.response
+
+
+async def collect(pool: OllamaPool) -> list[str]:
+    return [token async for token in pool.stream(MODEL, generate_tokens)]
+
+
+def test_stream_fails_over_to_next_endpoint_before_first_token(stubs):
+    healthy = stubs()
+    pool = OllamaPool([closed_url(), healthy.url])
+
+    assert asyncio.run(collect(pool)) == ["Hello", " world"]
+    dead, alive = pool.endpoints
+    assert not dead.healthy
+    assert alive.healthy and MODEL in alive.loaded_models
+    assert dead.outstanding == alive.outstanding == 0
+
+
+def test_call_fails_over_when_endpoint_is_unavailable(stubs):
+    unavailable = stubs(status=503)
+    healthy = stubs()
+    pool = OllamaPool([unavailable.url, healthy.url])
+
+    async def generate(endpoint: OllamaEndpoint) -> str:
+        response = await endpoint.client.generate(model=MODEL, prompt="hi")
+        return response.response
+
+    assert asyncio.run(pool.call(MODEL, generate)) == "Hello world"
+    assert unavailable.generate_calls == 1
+    assert not pool.endpoints[0].healthy
+
+
+def test_stream_does_not_fail_over_after_first_token(stubs):
+    broken = stubs(drop_after_first_token=True)
+    healthy = stubs()
+    pool = OllamaPool([broken.url, healthy.url])
+
+    # a connection error, but the text already sent cannot be taken back
+    with pytest.raises(httpx.TransportError):
+        asyncio.run(collect(pool))
+    assert broken.generate_calls == 1 and healthy.generate_calls == 0
+
+
+def test_routes_to_endpoint_with_model_loaded(stubs):
+    cold = stubs()
+    warm = stubs(loaded=(MODEL,))
+    pool = OllamaPool([cold.url, warm.url])
+    cold_endpoint, warm_endpoint = pool.endpoints
+
+    async def run() -> list[str]:
+        await pool.check()
+        # affinity wins over load
+        warm_endpoint.outstanding = 3
+        assert pool.choose(MODEL) is warm_endpoint
+        assert pool.choose("other-model") is cold_endpoint
+        warm_endpoint.outstanding = 0
+        return await collect(pool)
+
+    assert asyncio.run(run()) == ["Hello", " world"]
+    assert warm.generate_calls == 1 and cold.generate_calls == 0
+
+
+def test_routes_to_least_outstanding_endpoint(stubs):
+    first = stubs(loaded=(MODEL,))
+    second = stubs(loaded=(MODEL,))
+    pool = OllamaPool([first.url, second.url])
+    asyncio.run(pool.check())
+
+    pool.endpoints[0].outstanding = 2
+    pool.endpoints[1].outstanding = 1
+    assert pool.choose(MODEL) is pool.endpoints[1]
+    assert pool.choose(MODEL, exclude=[pool.endpoints[1]]) is pool.endpoints[0]
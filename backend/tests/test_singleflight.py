@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+
+from singleflight import Flight, LocalFollower, RemoteFollower, SingleFlight, SingleFlightError
+
+fakeredis = pytest.importorskip("fakeredis")
+
+PROMPT = "How do I read a parquet file?"
+
+
+def single_flight(redis_client, **kwargs) -> SingleFlight:
+    kwargs.setdefault("poll_interval", 0.1)
+    return SingleFlight(redis_client, certainty=0.95, **kwargs)
+
+
+async def collect(follower) -> list:
+    return [chunk async for chunk in follower.subscribe()]
+
+
+def test_local_follower_replays_and_follows():
+    async def run():
+        flights = single_flight(fakeredis.FakeAsyncRedis())
+        flight = await flights.acquire(PROMPT)
+        assert isinstance(flight, Flight)
+        await flights.publish(flight, {"completion": "a"})
+
+        follower = await flights.acquire(PROMPT)
+        assert isinstance(follower, LocalFollower)
+        task = asyncio.create_task(collect(follower))
+        await flights.publish(flight, {"completion": "b"})
+        await flights.release(flight)
+        assert await asyncio.wait_for(task, 1) == [
+            {"completion": "a"},
+            {"completion": "b"},
+        ]
+
+    asyncio.run(run())
+
+
+def test_similar_prompt_follows_locally():
+    async def run():
+        flights = single_flight(fakeredis.FakeAsyncRedis())
+        flight = await flights.acquire(PROMPT, [1.0, 0.0])
+        follower = await flights.acquire("Reading parquet files?", [0.99, 0.05])
+        assert isinstance(follower, LocalFollower)
+        other = await flights.acquire("Something else", [0.0, 1.0])
+        assert isinstance(other, Flight)
+        await flights.release(flight)
+        await flights.release(other)
+
+    asyncio.run(run())
+
+
+def test_remote_follower_replays_and_follows():
+    async def run():
+        redis_client = fakeredis.FakeAsyncRedis()
+        leader = single_flight(redis_client)
+        flight = await leader.acquire(PROMPT)
+        await leader.publish(flight, {"completion": "a"})
+
+        follower = await single_flight(redis_client).acquire(PROMPT)
+        assert isinstance(follower, RemoteFollower)
+        task = asyncio.create_task(collect(follower))
+        await asyncio.sleep(0.05)
+        await leader.publish(flight, {"completion": "b"})
+        await leader.publish(flight, {"links": ["x"]})
+        await leader.release(flight)
+        assert await asyncio.wait_for(task, 2) == [
+            {"completion": "a"},
+            {"completion": "b"},
+            {"links": ["x"]},
+        ]
+
+    asyncio.run(run())
+
+
+def test_failure_reaches_every_follower():
+    async def run():
+        redis_client = fakeredis.FakeAsyncRedis()
+        leader = single_flight(redis_client)
+        flight = await leader.acquire(PROMPT)
+        local = await leader.acquire(PROMPT)
+        remote = await single_flight(redis_client).acquire(PROMPT)
+        tasks = [asyncio.create_task(collect(f)) for f in (local, remote)]
+        await asyncio.sleep(0.05)
+        await leader.release(flight, "ollama is down")
+        for task in tasks:
+            with pytest.raises(SingleFlightError, match="ollama is down"):
+                await asyncio.wait_for(task, 2)
+
+    asyncio.run(run())
+
+
+def test_generation_outlives_the_leading_request():
+    async def run():
+        flights = single_flight(fakeredis.FakeAsyncRedis())
+        flight = await flights.acquire(PROMPT)
+
+        async def generate():
+            try:
+                for piece in ("a", "b", "c"):
+                    await asyncio.sleep(0.02)
+                    await flights.publish(flight, {"completion": piece})
+            finally:
+                await flights.release(flight)
+
+        leading = asyncio.create_task(collect(flights.lead(flight, generate())))
+        follower = await flights.acquire(PROMPT)
+        following = asyncio.create_task(collect(follower))
+        await asyncio.sleep(0.03)
+        # the client of the leading request disconnects
+        leading.cancel()
+        assert await asyncio.wait_for(following, 1) == [
+            {"completion": "a"},
+            {"completion": "b"},
+            {"completion": "c"},
+        ]
+
+    asyncio.run(run())
+
+
+def test_claim_is_renewed_while_the_leader_waits():
+    async def run():
+        redis_client = fakeredis.FakeAsyncRedis()
+        leader = single_flight(redis_client, claim_ttl=1)
+        flight = await leader.acquire(PROMPT)
+        # longer than claim_ttl without publishing, as in the admission queue
+        await asyncio.sleep(1.5)
+        follower = await single_flight(redis_client).acquire(PROMPT)
+        assert isinstance(follower, RemoteFollower)
+        await leader.release(flight)
+
+    asyncio.run(run())
+
+
+def test_claim_expires_when_the_leader_is_gone():
+    async def run():
+        redis_client = fakeredis.FakeAsyncRedis()
+        leader = single_flight(redis_client, claim_ttl=1)
+        flight = await leader.acquire(PROMPT)
+        await leader.publish(flight, {"completion": "a"})
+        # the leading worker dies without releasing its flight
+        flight._renewal.cancel()
+
+        follower = await single_flight(redis_client).acquire(PROMPT)
+        assert isinstance(follower, RemoteFollower)
+        chunks = []
+        with pytest.raises(SingleFlightError, match="leader stopped"):
+            async for chunk in follower.subscribe():
+                chunks.append(chunk)
+        assert chunks == [{"completion": "a"}]
+
+        # the prompt can be generated again
+        assert isinstance(await single_flight(redis_client).acquire(PROMPT), Flight)
+
+    asyncio.run(run())
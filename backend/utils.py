@@ -1,17 +1,94 @@
-from ollama import Client
+from typing import Any
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.outputs import LLMResult
 
-def get_num_tokens(client: Client, model: str, input: str) -> int:
-    """ Returns the total number of tokens in input string
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover
+    tiktoken = None
+
+_encoding = None
+
+
+def load_encoding() -> None:
+    """Loads the tiktoken encoding used by count_tokens_locally
+
+    The first load downloads the BPE file, so this blocks and is called once
+    at startup, in a thread. Until it succeeds the whitespace estimate is
+    used.
+    """
+    global _encoding
+    if tiktoken is None or _encoding is not None:
+        return
+    try:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(e)
+
+
+def count_tokens_locally(input: str) -> int:
+    """ Estimates the number of tokens in input string without calling the llm
+
+    Uses the tiktoken encoding once load_encoding loaded it, otherwise falls
+    back to a whitespace split.
 
     Args:
-        client: ollama client
-        model: ollama model
         input: input string to tokenize
-    
+
     Returns:
         Integer count of the number of tokens
     """
-    embed = client.embed(model=model, input=input)
-    num_tokens = embed.prompt_eval_count
-    assert num_tokens is not None 
-    return num_tokens
+    if _encoding is not None:
+        return len(_encoding.encode(input, disallowed_special=()))
+    return len(input.split())
+
+
+class TokenUsageHandler(AsyncCallbackHandler):
+    """Collects the token counts ollama reports with a generation
+
+    Ollama returns ``prompt_eval_count`` and ``eval_count`` in the final
+    response of every generation, so no extra forward pass is needed to
+    count tokens.
+    """
+
+    def __init__(self) -> None:
+        self.prompt_tokens: int | None = None
+        self.completion_tokens: int | None = None
+        self.load_duration: int | None = None
+        """Time ollama spent loading the model, in nanoseconds"""
+        self._prompts: list[str] = []
+        self._completion = ""
+
+    async def on_llm_start(
+        self, serialized: dict[str, Any], prompts: list[str], **kwargs: Any
+    ) -> None:
+        self._prompts = prompts
+
+    async def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                info = generation.generation_info or {}
+                if info.get("prompt_eval_count") is not None:
+                    self.prompt_tokens = info["prompt_eval_count"]
+                if info.get("eval_count") is not None:
+                    self.completion_tokens = info["eval_count"]
+                if info.get("load_duration") is not None:
+                    self.load_duration = info["load_duration"]
+                self._completion += generation.text
+
+    def usage(self) -> tuple[int, int]:
+        """ Returns the prompt and completion token counts of the generation
+
+        Counts missing from the ollama response, for example when the whole
+        prompt was served from the KV cache, are estimated locally.
+
+        Returns:
+            Tuple of prompt tokens and completion tokens
+        """
+        prompt_tokens = self.prompt_tokens
+        if prompt_tokens is None:
+            prompt_tokens = sum(count_tokens_locally(p) for p in self._prompts)
+        completion_tokens = self.completion_tokens
+        if completion_tokens is None:
+            completion_tokens = count_tokens_locally(self._completion)
+        return prompt_tokens, completion_tokens
@@ -1,80 +1,168 @@
 from pydantic import BaseModel, ConfigDict
 import weaviate
-from teiembedding import TextEmbeddingsInference
+from retrievalcontext import RetrievalContext
 import datetime
 from weaviate.classes.query import Filter
-from constants import cache_collection_name
+from weaviate.classes.config import DataType, Property, Tokenization
+from constants import cache_collection_name, cache_certainty, cache_ttl_seconds
+from cachewriter import CacheWriter
+
+PENDING = "pending"
+READY = "ready"
+
+
+class VectorCacheMatch(BaseModel):
+    query: str
+    uuid: str
+    vector: list[float]
 
 
 class WeaviateStore(BaseModel):
     model_config = ConfigDict(arbitrary_types_allowed=True)
-    weaviate_client: weaviate.WeaviateClient
-    tei_client: TextEmbeddingsInference
+    weaviate_client: weaviate.WeaviateAsyncClient
     embedding_model: str
     llm: str
+    cache_writer: CacheWriter | None = None
+    """Defers inserts and updates to a background flush when set"""
 
-    def search_vector_cache(self, text: str) -> list[str]:
-        """Searches vector cache for text
+    async def ensure_schema(self) -> None:
+        """Adds the status property to a cache collection created before it
+        existed
+
+        The schema in weaviate/entrypoint.sh is only applied to a new
+        collection, and filtering on a property unknown to weaviate fails.
+        Entries written before have no status and are never matched, they
+        expire as usual.
+        """
+        collection = self.weaviate_client.collections.get(cache_collection_name)
+        config = await collection.config.get()
+        if any(p.name == "status" for p in config.properties):
+            return
+        await collection.config.add_property(
+            Property(
+                name="status",
+                data_type=DataType.TEXT,
+                index_filterable=True,
+                index_searchable=False,
+                tokenization=Tokenization.WORD,
+            )
+        )
+
+    async def search_vector_cache(
+        self, ctx: RetrievalContext
+    ) -> list[VectorCacheMatch]:
+        """Searches vector cache for ready entries matching the query in ctx
 
         Args:
-            text: text to search
+            ctx: retrieval context holding the query and its embedding
 
         Returns:
-            List of matching text in the vector db
+            List of matching entries in the vector db
         """
 
-        last_24h = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
-            hours=24
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+            seconds=cache_ttl_seconds
         )
-        filter_date = Filter.by_property("last_modified_date").greater_than(last_24h)
+        filter_date = Filter.by_property("last_modified_date").greater_than(cutoff)
         filter_embedding = Filter.by_property("embedding_model").equal(
             self.embedding_model
         )
         filter_llm = Filter.by_property("llm").equal(self.llm)
+        filter_status = Filter.by_property("status").equal(READY)
 
         collection = self.weaviate_client.collections.get(cache_collection_name)
 
-        vec = self.tei_client.embed_query(text)
-
-        result = collection.query.near_vector(
-            vec,
-            certainty=0.95,
+        result = await collection.query.near_vector(
+            ctx.vector,
+            certainty=cache_certainty,
             limit=1,
-            filters=(filter_date & filter_embedding & filter_llm),
+            filters=(filter_date & filter_embedding & filter_llm & filter_status),
+            include_vector=True,
         )
         if len(result.objects) == 0:
             return []
         update_id = result.objects[0].uuid
+        await self.touch_vector_cache(str(update_id))
+        return [
+            VectorCacheMatch(
+                query=str(result.objects[0].properties["query"]),
+                uuid=str(update_id),
+                vector=result.objects[0].vector.get("default", ctx.vector),
+            )
+        ]
 
-        collection.data.update(
-            uuid=update_id,
-            properties={
-                "last_modified_date": datetime.datetime.now(datetime.timezone.utc)
-            },
-        )
-        return [str(result.objects[0].properties["query"])]
-
-    def insert_vector_cache(self, text: str) -> None:
-        """Insert vector embedding of text into vector db
+    async def insert_vector_cache(
+        self, ctx: RetrievalContext, status: str = PENDING
+    ) -> str:
+        """Insert vector embedding of the query in ctx into vector db
 
         Args:
-            text: string to store into db
+            ctx: retrieval context holding the query and its embedding
+            status: pending while the answer is generated, ready once stored
 
+        Returns:
+            uuid of the inserted entry
         """
-        vec = self.tei_client.embed_query(text)
 
         collection = self.weaviate_client.collections.get(cache_collection_name)
         current_time = datetime.datetime.now(datetime.timezone.utc)
         property = {
-            "query": text,
+            "query": ctx.prompt,
             "created_on": current_time,
             "last_modified_date": current_time,
             "embedding_model": self.embedding_model,
             "llm": self.llm,
+            "status": status,
         }
-        with collection.batch.dynamic() as batch:
-            # Add object to batch queue
-            batch.add_object(properties=property, vector=vec)
+        if self.cache_writer is not None:
+            return self.cache_writer.insert(property, ctx.vector)
+        uuid = await collection.data.insert(properties=property, vector=ctx.vector)
+        return str(uuid)
+
+    async def touch_vector_cache(self, uuid: str) -> None:
+        """Refreshes last_modified_date of an entry after a cache hit
+
+        Args:
+            uuid: uuid of the entry
+        """
+        if self.cache_writer is not None:
+            self.cache_writer.touch(uuid)
+            return
+        collection = self.weaviate_client.collections.get(cache_collection_name)
+        await collection.data.update(
+            uuid=uuid,
+            properties={
+                "last_modified_date": datetime.datetime.now(datetime.timezone.utc)
+            },
+        )
+
+    async def mark_ready(self, uuid: str) -> None:
+        """Marks a pending entry as ready once its answer is stored
+
+        Args:
+            uuid: uuid of the entry
+        """
+        properties = {
+            "status": READY,
+            "last_modified_date": datetime.datetime.now(datetime.timezone.utc),
+        }
+        if self.cache_writer is not None:
+            self.cache_writer.update(uuid, properties)
+            return
+        collection = self.weaviate_client.collections.get(cache_collection_name)
+        await collection.data.update(uuid=uuid, properties=properties)
+
+    async def delete_vector_cache(self, uuid: str) -> None:
+        """Deletes an entry whose answer is no longer available
+
+        Args:
+            uuid: uuid of the entry
+        """
+        if self.cache_writer is not None:
+            await self.cache_writer.delete(uuid)
+            return
+        collection = self.weaviate_client.collections.get(cache_collection_name)
+        await collection.data.delete_by_id(uuid)
 
-    def close(self):
-        self.weaviate_client.close()
+    async def close(self):
+        await self.weaviate_client.close()
@@ -0,0 +1,233 @@
+"""Retrieval benchmark over a grid of hybrid search alpha and k values
+
+Loads the question set written by eval.ipynb, embeds every question once,
+then runs the hybrid queries of each (alpha, k) pair concurrently against
+the document collection. A retrieved chunk is relevant when it is the chunk
+the question was generated from. Hit rate, MRR and latency percentiles of
+every pair are printed as JSON.
+
+    python benchmark.py --questions results.json --alpha 0.5 0.7 0.9 --k 3 4 5
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import weaviate
+
+ROOT = Path(__file__).resolve().parents[1]
+# constants come from the backend, the embedding client from shared/
+sys.path[:0] = [str(ROOT / "backend"), str(ROOT)]
+
+from constants import alpha as default_alpha, collection_name, k as default_k  # noqa: E402
+from shared.teiembedding import TextEmbeddingsInference  # noqa: E402
+
+PERCENTILES = [50, 90, 95, 99]
+
+
+def source_key(properties: dict[str, Any]) -> tuple[str, str]:
+    """Identifies a chunk by its link and the start of its text"""
+    return str(properties["link"]), str(properties["text"])[:20]
+
+
+def load_questions(
+    path: Path, limit: int | None = None
+) -> tuple[list[str], list[tuple[str, str]]]:
+    """Reads the questions and the chunk each one was generated from
+
+    Args:
+        path: json list of chunks with their generated questions
+        limit: maximum number of chunks to read
+
+    Returns:
+        Questions and the source key of every question
+    """
+    chunks = json.loads(path.read_text())
+    questions: list[str] = []
+    sources: list[tuple[str, str]] = []
+    for chunk in chunks[:limit]:
+        for question in chunk["question"]:
+            questions.append(question)
+            sources.append(source_key(chunk))
+    return questions, sources
+
+
+def ranking_metrics(relevance: np.ndarray) -> dict[str, float]:
+    """Computes hit rate and MRR
+
+    Args:
+        relevance: boolean array of shape (questions, k), true where the
+            result at that rank is relevant
+
+    Returns:
+        hit_rate and mrr
+    """
+    hits = relevance.any(axis=1)
+    first = relevance.argmax(axis=1)
+    reciprocal_ranks = np.where(hits, 1.0 / (first + 1), 0.0)
+    return {"hit_rate": float(hits.mean()), "mrr": float(reciprocal_ranks.mean())}
+
+
+def latency_summary(latencies: np.ndarray) -> dict[str, float]:
+    """Summarizes query latencies given in seconds, in milliseconds"""
+    ms = latencies * 1000
+    summary = {
+        f"p{p}": float(v) for p, v in zip(PERCENTILES, np.percentile(ms, PERCENTILES))
+    }
+    summary["mean"] = float(ms.mean())
+    summary["max"] = float(ms.max())
+    return summary
+
+
+async def run_config(
+    collection,
+    questions: list[str],
+    vectors: list[list[float]],
+    sources: list[tuple[str, str]],
+    alpha: float,
+    k: int,
+    concurrency: int,
+) -> dict[str, Any]:
+    """Runs the hybrid query of every question for one alpha and k
+
+    Returns:
+        Ranking metrics, latency percentiles and throughput
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    relevance = np.zeros((len(questions), k), dtype=bool)
+    latencies = np.zeros(len(questions))
+
+    async def query(idx: int) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            result = await collection.query.hybrid(
+                questions[idx],
+                alpha=alpha,
+                vector=vectors[idx],
+                limit=k,
+                return_properties=["link", "text"],
+            )
+            latencies[idx] = time.perf_counter() - started
+        for rank, obj in enumerate(result.objects[:k]):
+            relevance[idx, rank] = source_key(obj.properties) == sources[idx]
+
+    started = time.perf_counter()
+    await asyncio.gather(*(query(idx) for idx in range(len(questions))))
+    elapsed = time.perf_counter() - started
+    return {
+        "alpha": alpha,
+        "k": k,
+        **ranking_metrics(relevance),
+        "latency_ms": latency_summary(latencies),
+        "queries_per_second": len(questions) / elapsed,
+    }
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    questions, sources = load_questions(args.questions, args.limit)
+    if len(questions) == 0:
+        raise ValueError(f"no questions in {args.questions}")
+
+    embeddings = TextEmbeddingsInference(
+        url=args.tei_url,
+        normalize=True,
+        batch_size=args.batch_size,
+        max_concurrency=args.concurrency,
+        model=args.model,
+        cache_dir=args.embedding_cache_dir,
+    )
+    client = weaviate.use_async_with_local(
+        host=args.weaviate_host, port=args.weaviate_port
+    )
+    try:
+        await embeddings.async_server_limits()
+        started = time.perf_counter()
+        vectors = await embeddings.aembed_documents(questions)
+        embed_seconds = time.perf_counter() - started
+
+        await client.connect()
+        collection = client.collections.get(collection_name)
+        # fill connection pools and caches before anything is timed
+        warmup = min(args.warmup, len(questions))
+        if warmup > 0:
+            await run_config(
+                collection,
+                questions[:warmup],
+                vectors[:warmup],
+                sources[:warmup],
+                args.alpha[0],
+                args.k[0],
+                args.concurrency,
+            )
+
+        # pairs run one after the other so their latencies do not mix
+        results = []
+        for alpha in args.alpha:
+            for k in args.k:
+                results.append(
+                    await run_config(
+                        collection,
+                        questions,
+                        vectors,
+                        sources,
+                        alpha,
+                        k,
+                        args.concurrency,
+                    )
+                )
+    finally:
+        await client.close()
+        await embeddings.aclose()
+
+    return {
+        "questions": len(questions),
+        "concurrency": args.concurrency,
+        "embed_seconds": embed_seconds,
+        "results": results,
+    }
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=Path, default=Path("results.json"))
+    parser.add_argument(
+        "--limit", type=int, default=None, help="number of chunks to use"
+    )
+    parser.add_argument("--alpha", type=float, nargs="+", default=[default_alpha])
+    parser.add_argument("--k", type=int, nargs="+", default=[default_k])
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="queries in flight at once"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=10, help="untimed queries run first"
+    )
+    parser.add_argument("--weaviate-host", default="localhost")
+    parser.add_argument("--weaviate-port", type=int, default=8090)
+    parser.add_argument("--tei-url", default="http://localhost:8080")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument(
+        "--model", default=None, help="embedding model, enables the embedding cache"
+    )
+    parser.add_argument("--embedding-cache-dir", default=None)
+    parser.add_argument(
+        "--output", type=Path, default=None, help="write the report here too"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output is not None:
+        args.output.write_text(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,3 +7,16 @@ class ModelSchema(msgspec.Struct):
 
 class LlmCompletionSchema(msgspec.Struct):
     completion: str
+
+
+class QueueStatus(msgspec.Struct):
+    position: int
+    eta: float
+
+
+class StreamFrame(msgspec.Struct):
+    """One newline delimited frame of the /llm/stream response"""
+
+    completion: str | None = None
+    links: list[str] | None = None
+    queue: QueueStatus | None = None
@@ -1,8 +1,7 @@
 from shiny import App, ui, Inputs, Outputs, Session
 import httpx
 import os
-import json
-from shared.api_models import ModelSchema
+from shared.api_models import ModelSchema, StreamFrame
 import msgspec
 from appconfig import config
 
@@ -11,6 +10,7 @@ SERVER_PORT = config.server_port
 client = httpx.AsyncClient(timeout=120)
 
 decoder = msgspec.json.Decoder(type=ModelSchema)
+frame_decoder = msgspec.json.Decoder(type=StreamFrame)
 
 r = httpx.get(f"http://{SERVER_HOST}:{SERVER_PORT}/models")
 choices = decoder.decode(r.content).models
@@ -42,12 +42,32 @@ def server(input: Inputs, output: Outputs, session: Session) -> None:
 
     async def respone_to_iterator(r: httpx.Response):
         links_list: list[str] = []
+        # frames are newline delimited, network chunks may split or merge them
+        buffer = b""
+        queued = False
         async for message in r.aiter_bytes():
-            data_dict = json.loads(message.decode())
-            if "completion" in data_dict:
-                yield data_dict["completion"]
-            elif "links" in data_dict:
-                links_list = data_dict["links"]
+            buffer += message
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if not line.strip():
+                    continue
+                frame = frame_decoder.decode(line)
+                if frame.queue is not None:
+                    ui.notification_show(
+                        f"Waiting in queue at position {frame.queue.position}, "
+                        f"about {frame.queue.eta:.0f}s",
+                        id="queue",
+                        duration=None,
+                    )
+                    queued = True
+                    continue
+                if queued:
+                    ui.notification_remove("queue")
+                    queued = False
+                if frame.completion is not None:
+                    yield frame.completion
+                elif frame.links is not None:
+                    links_list = frame.links
         yield "\n\nCitations\n"
         for link in links_list:
             yield f"- {link}\n"
@@ -65,6 +85,12 @@ def server(input: Inputs, output: Outputs, session: Session) -> None:
             "POST", f"http://{SERVER_HOST}:{SERVER_PORT}/llm/stream", json=payload
         )
         r = await client.send(req, stream=True)
+        if r.status_code == 429:
+            await r.aclose()
+            ui.notification_show(
+                "The server is busy, please try again later", type="warning"
+            )
+            return
         response_iter = respone_to_iterator(r)
         await chat.append_message_stream(response_iter)
 
@@ -0,0 +1,167 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+from pathlib import Path
+from typing import List, Sequence
+
+import numpy as np
+
+# each index record is the sha256 digest of a text, row i of the vectors
+# file holds the embedding of record i
+KEY_SIZE = 32
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.sha256(text.encode()).digest()
+
+
+class EmbeddingStore:
+    def __init__(
+        self, path: str, model: str, normalize: bool, read_only: bool = False
+    ):
+        """
+        Embeddings on disk keyed by model, normalize flag and text hash
+
+        Every (model, normalize) pair gets its own directory under path with
+        a meta.json, an index.bin of text digests and a vectors.f32 array
+        read through a memory map. Both files are only appended to, under an
+        exclusive lock, so several processes can share the directory and it
+        can be copied to another machine as is. Rows written by others are
+        picked up on the next miss. A read only store creates nothing, so it
+        works on a directory owned by another user, even before it exists.
+        """
+        variant = "normalized" if normalize else "raw"
+        name = re.sub(r"[^A-Za-z0-9_.-]+", "_", model)
+        self.directory = Path(path) / f"{name}-{variant}"
+        self.model = model
+        self.normalize = normalize
+        self.read_only = read_only
+        self.index_path = self.directory / "index.bin"
+        self.vectors_path = self.directory / "vectors.f32"
+        self.meta_path = self.directory / "meta.json"
+        if not read_only:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self.index_path.touch(exist_ok=True)
+            self.vectors_path.touch(exist_ok=True)
+        self.dim: int | None = None
+        self._rows: dict[bytes, int] = {}
+        self._indexed = 0
+        self._vectors: np.memmap | None = None
+        self._lock = threading.Lock()
+        with self._lock:
+            self._refresh()
+
+    def __len__(self) -> int:
+        return self._indexed
+
+    def _stored_rows(self) -> int:
+        """
+        Rows present in both files, a write torn by a crash is ignored
+        """
+        if self.dim is None:
+            return 0
+        try:
+            rows = os.path.getsize(self.index_path) // KEY_SIZE
+            vectors = os.path.getsize(self.vectors_path) // (self.dim * 4)
+        except FileNotFoundError:
+            return 0
+        return min(rows, vectors)
+
+    def _refresh(self) -> None:
+        """
+        Read index records appended since the last refresh
+        """
+        if self.dim is None and self.meta_path.exists():
+            self.dim = json.loads(self.meta_path.read_text())["dim"]
+        rows = self._stored_rows()
+        if rows <= self._indexed:
+            return
+        with open(self.index_path, "rb") as f:
+            f.seek(self._indexed * KEY_SIZE)
+            data = f.read((rows - self._indexed) * KEY_SIZE)
+        for offset in range(0, len(data), KEY_SIZE):
+            self._rows.setdefault(data[offset : offset + KEY_SIZE], self._indexed)
+            self._indexed += 1
+        self._vectors = None
+
+    def _mapped(self) -> np.memmap:
+        if self._vectors is None:
+            assert self.dim is not None
+            self._vectors = np.memmap(
+                self.vectors_path,
+                dtype=np.float32,
+                mode="r",
+                shape=(self._indexed, self.dim),
+            )
+        return self._vectors
+
+    def get_many(self, texts: Sequence[str]) -> List[List[float] | None]:
+        """Looks up stored embeddings
+
+        Args:
+            texts: texts to look up
+
+        Returns:
+            Embedding of every text, or None when it is not stored
+        """
+        keys = [text_key(text) for text in texts]
+        with self._lock:
+            if any(key not in self._rows for key in keys):
+                self._refresh()
+            rows = [self._rows.get(key) for key in keys]
+            if all(row is None for row in rows):
+                return [None] * len(texts)
+            vectors = self._mapped()
+            return [None if row is None else vectors[row].tolist() for row in rows]
+
+    def put_many(self, texts: Sequence[str], embeddings: Sequence[List[float]]) -> None:
+        """Stores embeddings of texts that are not stored yet
+
+        Args:
+            texts: embedded texts
+            embeddings: embedding of every text
+        """
+        if self.read_only:
+            raise ValueError(f"embedding store {self.directory} is read only")
+        if len(texts) == 0:
+            return
+        with self._lock, open(self.index_path, "r+b") as index:
+            fcntl.flock(index, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                if self.dim is None:
+                    self.dim = len(embeddings[0])
+                    meta = {
+                        "model": self.model,
+                        "normalize": self.normalize,
+                        "dim": self.dim,
+                    }
+                    self.meta_path.write_text(json.dumps(meta))
+                new: dict[bytes, List[float]] = {}
+                for text, embedding in zip(texts, embeddings):
+                    key = text_key(text)
+                    if key not in self._rows:
+                        new[key] = embedding
+                if len(new) == 0:
+                    return
+                array = np.asarray(list(new.values()), dtype=np.float32)
+                if array.shape[1] != self.dim:
+                    raise ValueError(
+                        f"embedding size {array.shape[1]} does not match {self.dim}"
+                    )
+                rows = self._stored_rows()
+                # vectors go first so an index record never points past them
+                with open(self.vectors_path, "r+b") as vectors:
+                    vectors.seek(rows * self.dim * 4)
+                    vectors.write(array.tobytes())
+                    vectors.truncate()
+                index.seek(rows * KEY_SIZE)
+                index.write(b"".join(new))
+                index.truncate()
+                index.flush()
+                self._refresh()
+            finally:
+                fcntl.flock(index, fcntl.LOCK_UN)
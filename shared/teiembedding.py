@@ -0,0 +1,287 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, List
+
+from pydantic import BaseModel, PrivateAttr
+import httpx
+
+from shared.embeddingstore import EmbeddingStore
+
+try:
+    from langchain_core.embeddings import Embeddings
+except ImportError:  # pragma: no cover
+    # the loader does not depend on langchain
+    Embeddings = object  # type: ignore[misc,assignment]
+
+
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+
+def batched(iterable, n):
+    # batched('ABCDEFG', 3) → ABC DEF G
+    if n < 1:
+        raise ValueError("n must be at least one")
+    iterator = iter(iterable)
+    while batch := tuple(islice(iterator, n)):
+        yield batch
+
+
+class TextEmbeddingsInference(BaseModel, Embeddings):
+    url: str
+    """Url of text embeddings inference server"""
+    normalize: bool = True
+    batch_size: int = 32
+    """Number of texts sent per /embed request, capped by the server's max_client_batch_size"""
+    max_concurrency: int = 4
+    """Maximum number of /embed requests in flight at once"""
+    max_retries: int = 3
+    backoff: float = 0.5
+    """Base delay in seconds between retries, doubled after every attempt"""
+    timeout: float = 60
+    model: str | None = None
+    """Embedding model served by the server, part of the cache key"""
+    cache_dir: str | None = None
+    """Directory of the on-disk embedding cache, disabled when unset"""
+    cache_read_only: bool = False
+    """Only look embeddings up in the cache, never add to it"""
+
+    _client: httpx.Client | None = PrivateAttr(default=None)
+    _aclient: httpx.AsyncClient | None = PrivateAttr(default=None)
+    _semaphore: asyncio.Semaphore | None = PrivateAttr(default=None)
+    _store: EmbeddingStore | None = PrivateAttr(default=None)
+    _store_failed: bool = PrivateAttr(default=False)
+
+    def _caching(self) -> bool:
+        return bool(self.cache_dir and self.model) and not self._store_failed
+
+    @property
+    def store(self) -> EmbeddingStore | None:
+        """On-disk embedding cache, None when disabled or it cannot be opened"""
+        if self._store is None and self._caching():
+            try:
+                self._store = EmbeddingStore(
+                    self.cache_dir,
+                    self.model,
+                    self.normalize,
+                    read_only=self.cache_read_only,
+                )
+            except Exception as e:
+                # embed without the cache rather than fail every request
+                print(e)
+                self._store_failed = True
+        return self._store
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self._max_connections(),
+            max_keepalive_connections=self._max_connections(),
+        )
+
+    def _max_connections(self) -> int:
+        return max(self.max_concurrency, 1)
+
+    @property
+    def client(self) -> httpx.Client:
+        if self._client is None:
+            self._client = httpx.Client(
+                base_url=self.url, timeout=self.timeout, limits=self._limits()
+            )
+        return self._client
+
+    @property
+    def aclient(self) -> httpx.AsyncClient:
+        if self._aclient is None:
+            self._aclient = httpx.AsyncClient(
+                base_url=self.url, timeout=self.timeout, limits=self._limits()
+            )
+            self._semaphore = asyncio.Semaphore(self._max_connections())
+        return self._aclient
+
+    def _payload(self, batch: tuple[str, ...]) -> dict[str, Any]:
+        return {
+            "inputs": list(batch),
+            "normalize": self.normalize,
+            "truncate": True,
+        }
+
+    def _apply_info(self, info: dict[str, Any]) -> None:
+        max_batch = info.get("max_client_batch_size")
+        if max_batch:
+            self.batch_size = min(self.batch_size, int(max_batch))
+
+    def wait_until_healthy(self, interval: float = 5) -> None:
+        """Blocks until the TEI server answers its health check"""
+        while True:
+            try:
+                resp = self.client.get("/health")
+                if resp.status_code == 200:
+                    return
+            except httpx.TransportError as e:
+                print(e)
+            time.sleep(interval)
+
+    def sync_server_limits(self) -> None:
+        """Caps batch_size to the max_client_batch_size reported by /info"""
+        resp = self.client.get("/info")
+        resp.raise_for_status()
+        self._apply_info(resp.json())
+
+    async def async_server_limits(self) -> None:
+        """Caps batch_size to the max_client_batch_size reported by /info"""
+        resp = await self.aclient.get("/info")
+        resp.raise_for_status()
+        self._apply_info(resp.json())
+
+    def _post_batch(self, batch: tuple[str, ...]) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                resp = self.client.post("/embed", json=self._payload(batch))
+                if resp.status_code not in RETRY_STATUS_CODES:
+                    resp.raise_for_status()
+                    return resp.json()
+                if attempt == self.max_retries:
+                    resp.raise_for_status()
+            except httpx.TransportError:
+                if attempt == self.max_retries:
+                    raise
+            time.sleep(self.backoff * 2**attempt)
+        raise RuntimeError("unreachable")
+
+    async def _apost_batch(self, batch: tuple[str, ...]) -> List[List[float]]:
+        client = self.aclient
+        assert self._semaphore is not None
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    resp = await client.post("/embed", json=self._payload(batch))
+                if resp.status_code not in RETRY_STATUS_CODES:
+                    resp.raise_for_status()
+                    return resp.json()
+                if attempt == self.max_retries:
+                    resp.raise_for_status()
+            except httpx.TransportError:
+                if attempt == self.max_retries:
+                    raise
+            await asyncio.sleep(self.backoff * 2**attempt)
+        raise RuntimeError("unreachable")
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        batches = list(batched(texts, self.batch_size))
+        if len(batches) <= 1:
+            return [vec for batch in batches for vec in self._post_batch(batch)]
+
+        embeddings = []
+        with ThreadPoolExecutor(max_workers=self._max_connections()) as executor:
+            for response in executor.map(self._post_batch, batches):
+                embeddings.extend(response)
+
+        return embeddings
+
+    def _missing(self, texts: List[str]) -> tuple[List[List[float] | None], List[str]]:
+        """Stored embeddings of texts and the distinct texts without one"""
+        store = self.store
+        if store is None:
+            return [None] * len(texts), list(dict.fromkeys(texts))
+        try:
+            embeddings = store.get_many(texts)
+        except Exception as e:
+            print(e)
+            embeddings = [None] * len(texts)
+        missing = [t for t, e in zip(texts, embeddings) if e is None]
+        return embeddings, list(dict.fromkeys(missing))
+
+    def _merge(
+        self,
+        texts: List[str],
+        embeddings: List[List[float] | None],
+        missing: List[str],
+        computed: List[List[float]],
+    ) -> List[List[float]]:
+        """Fills the computed embeddings in and stores them"""
+        store = self.store
+        if store is not None and not store.read_only and missing:
+            try:
+                store.put_many(missing, computed)
+            except Exception as e:
+                print(e)
+        by_text = dict(zip(missing, computed))
+        return [e if e is not None else by_text[t] for t, e in zip(texts, embeddings)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Compute doc embeddings using a Text Embeddings Inference server.
+
+        Embeddings found in the on-disk cache are not requested again.
+        Batches are sent concurrently, at most max_concurrency at a time.
+
+        Args:
+            texts: The list of texts to embed.
+
+        Returns:
+            List of embeddings, one for each text.
+        """
+        embeddings, missing = self._missing(texts)
+        computed = self._embed(missing) if missing else []
+        return self._merge(texts, embeddings, missing, computed)
+
+    def embed_query(self, text: str) -> List[float]:
+        """Compute query embeddings using a Text Embeddings Inference server.
+
+        Args:
+            text: The text to embed.
+
+        Returns:
+            Embeddings for the text.
+        """
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Asynchronously compute doc embeddings using a Text Embeddings Inference server.
+
+        Embeddings found in the on-disk cache are not requested again.
+        Batches are sent concurrently, at most max_concurrency at a time.
+
+        Args:
+            texts: The list of texts to embed.
+
+        Returns:
+            List of embeddings, one for each text.
+        """
+        # the cache reads files and waits for a lock, keep it off the event loop
+        if self._caching():
+            embeddings, missing = await asyncio.to_thread(self._missing, texts)
+        else:
+            embeddings, missing = self._missing(texts)
+        responses = await asyncio.gather(
+            *(self._apost_batch(batch) for batch in batched(missing, self.batch_size))
+        )
+        computed = [vec for response in responses for vec in response]
+        if self._caching() and not self.cache_read_only:
+            return await asyncio.to_thread(
+                self._merge, texts, embeddings, missing, computed
+            )
+        return self._merge(texts, embeddings, missing, computed)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Asynchronously compute query embeddings using a Text Embeddings Inference server.
+
+        Args:
+            text: The text to embed.
+
+        Returns:
+            Embeddings for the text.
+        """
+        embeddings = await self.aembed_documents([text])
+        return embeddings[0]
+
+    def close(self) -> None:
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def aclose(self) -> None:
+        self.close()
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
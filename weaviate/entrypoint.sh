@@ -85,6 +85,15 @@ wget --header 'content-type: application/json' --post-data '{
             "indexSearchable": false,
             "name": "embedding_model",
             "tokenization": "word"
+        },
+        {
+            "dataType": [
+                "text"
+            ],
+            "indexFilterable": true,
+            "indexSearchable": false,
+            "name": "content_hash",
+            "tokenization": "field"
         }
     ],
     "vectorIndexConfig": {
@@ -124,6 +133,15 @@ wget --header 'content-type: application/json' --post-data '{
             "name": "llm",
             "tokenization": "word"
         },
+        {
+            "dataType": [
+                "text"
+            ],
+            "indexFilterable": true,
+            "indexSearchable": false,
+            "name": "status",
+            "tokenization": "word"
+        },
         {
             "dataType": [
                 "date"
@@ -7,7 +7,18 @@ class AppConfig:
     weaviate_port = environ.var()
     tei_host = environ.var()
     tei_port = environ.var()
+    tei_batch_size = environ.var(default="32", converter=int)
+    tei_max_concurrency = environ.var(default="4", converter=int)
+    embedding_cache_dir = environ.var(default="")
     model = environ.var()
+    redis_host = environ.var()
+    redis_port = environ.var(converter=int)
+    loader_batch_size = environ.var(default="128", converter=int)
+    loader_queue_size = environ.var(default="4", converter=int)
+    loader_max_retries = environ.var(default="3", converter=int)
+    loader_checkpoint = environ.var(default="checkpoint.json")
+    # 0 uses every core
+    loader_parse_workers = environ.var(default="0", converter=int)
 
 
 config = environ.to_config(AppConfig)
@@ -1,85 +1,365 @@
-from typing import Any
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Iterable, Iterator
 from llama_index.core import SimpleDirectoryReader
 from llama_index.core.schema import MetadataMode
 from llama_index.core.node_parser import MarkdownNodeParser
 import weaviate
-from teiembedding import TextEmbeddingsInference
-
-import pandas as pd
+from weaviate.classes.query import Filter
+from weaviate.util import generate_uuid5
+import redis
+from shared.teiembedding import TextEmbeddingsInference
+from pipeline import Pipeline, StageStats
 from appconfig import config
 
 WEAVIATE_HOST = config.weaviate_host
 WEAVIATE_PORT = config.weaviate_port
 TEI_HOST = config.tei_host
 TEI_PORT = config.tei_port
+TEI_BATCH_SIZE = config.tei_batch_size
+TEI_MAX_CONCURRENCY = config.tei_max_concurrency
+EMBEDDING_CACHE_DIR = config.embedding_cache_dir
 EMBEDDING_MODEL = config.model
+REDIS_HOST = config.redis_host
+REDIS_PORT = config.redis_port
+LOADER_BATCH_SIZE = config.loader_batch_size
+LOADER_QUEUE_SIZE = config.loader_queue_size
+LOADER_MAX_RETRIES = config.loader_max_retries
+LOADER_CHECKPOINT = config.loader_checkpoint
+LOADER_PARSE_WORKERS = config.loader_parse_workers or os.cpu_count() or 1
+# must match retrieval_generation_key in the backend constants
+RETRIEVAL_GENERATION_KEY = "retrieval_cache:generation"
+
+
+def invalidate_retrieval_cache():
+    """Bumps the index generation so the backend stops serving retrieval
+    results cached before this import"""
+    redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT)
+    try:
+        redis_client.incr(RETRIEVAL_GENERATION_KEY)
+    finally:
+        redis_client.close()
+
+
+def relative_to_documents(file_path: str) -> str:
+    """Returns the part of file_path below the documents directory"""
+    word = "documents"
+    return file_path[file_path.find(word) + len(word) :]
+
+
+def chunk_id(relative_path: str, text: str) -> tuple[str, str]:
+    """Returns the deterministic uuid and content hash of a chunk
+
+    The uuid changes whenever the file, the chunk text or the embedding
+    model changes, so an unchanged chunk keeps its object across runs.
+    """
+    content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    uuid = generate_uuid5(f"{EMBEDDING_MODEL}:{relative_path}:{content_hash}")
+    return uuid, content_hash
+
+
+class SourceFile:
+    """Chunks of one document file"""
+
+    def __init__(
+        self,
+        relative_path: str,
+        fingerprint: str,
+        ids: list[str],
+        new: dict[str, dict[str, Any]],
+    ):
+        self.relative_path = relative_path
+        self.fingerprint = fingerprint
+        self.ids = ids
+        """uuids of every chunk of the file"""
+        self.new = new
+        """properties of the chunks missing from the collection"""
+
+
+class Batch:
+    """Files handed from one pipeline stage to the next"""
+
+    def __init__(self, files: list[SourceFile]):
+        self.files = files
+        self.vectors: list[list[float]] = []
+
+    def new_chunks(self) -> list[tuple[str, dict[str, Any]]]:
+        return [item for source in self.files for item in source.new.items()]
+
+
+class Checkpoint:
+    def __init__(self, path: str):
+        """
+        Files whose chunks were all written, with the size and mtime they had
+
+        An interrupted load resumes by skipping these files, and a re-run
+        does not even parse files that did not change.
+        """
+        self.path = path
+        self.files: dict[str, dict[str, Any]] = {}
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("embedding_model") == EMBEDDING_MODEL:
+                self.files = data["files"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def lookup(self, relative_path: str, fingerprint: str) -> list[str] | None:
+        entry = self.files.get(relative_path)
+        if entry is None or entry["fingerprint"] != fingerprint:
+            return None
+        return entry["ids"]
+
+    def add(self, source: SourceFile) -> None:
+        self.files[source.relative_path] = {
+            "fingerprint": source.fingerprint,
+            "ids": source.ids,
+        }
+
+    def retain(self, relative_paths: set[str]) -> None:
+        self.files = {k: v for k, v in self.files.items() if k in relative_paths}
+
+    def save(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"embedding_model": EMBEDDING_MODEL, "files": self.files}, f)
+        os.replace(tmp_path, self.path)
+
+
+def to_utc_datetime(value: str) -> datetime.datetime:
+    """Parses an ISO date or datetime, treating naive values as UTC"""
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.astimezone(datetime.timezone.utc)
+
+
+def parse_file(path: Path) -> dict[str, dict[str, Any]]:
+    """Splits a markdown document into chunks
+
+    Runs in a worker process. Date metadata is shared by every chunk of
+    the file, so each distinct value is converted once.
+
+    Returns:
+        Properties of every chunk keyed by its deterministic uuid
+    """
+    documents = SimpleDirectoryReader(input_files=[path]).load_data()
+
+    splitter = MarkdownNodeParser()
+
+    nodes = splitter.get_nodes_from_documents(documents)
+
+    chunks: dict[str, dict[str, Any]] = {}
+    dates: dict[str, datetime.datetime] = {}
+    url = "https://docs.pola.rs/user-guide"
+
+    for node in nodes:
+        text = node.get_content(metadata_mode=MetadataMode.NONE)
+        relative_path = relative_to_documents(node.metadata["file_path"])
+        link = url + relative_path[:-8]
+        uuid, content_hash = chunk_id(relative_path, text)
+        properties = node.metadata | {
+            "text": text,
+            "link": link,
+            "embedding_model": EMBEDDING_MODEL,
+            "content_hash": content_hash,
+        }
+        for key, value in properties.items():
+            if "date" in key and isinstance(value, str):
+                if value not in dates:
+                    dates[value] = to_utc_datetime(value)
+                properties[key] = dates[value]
+        chunks[uuid] = properties
+    return chunks
+
+
+def existing_ids(collection) -> set[str]:
+    """Returns the uuids of every object in the collection without fetching
+    properties or vectors"""
+    return {str(obj.uuid) for obj in collection.iterator(return_properties=[])}
+
+
+def delete_ids(collection, ids: list[str], batch_size: int = 1000) -> int:
+    """Deletes objects by uuid in batches
+
+    Returns:
+        Number of deleted objects
+    """
+    deleted = 0
+    for start in range(0, len(ids), batch_size):
+        response = collection.data.delete_many(
+            where=Filter.by_id().contains_any(ids[start : start + batch_size])
+        )
+        deleted += response.successful
+    return deleted
+
+
+def insert_objects(
+    collection, objects: dict[str, tuple[dict[str, Any], list[float]]]
+) -> set[str]:
+    """Batch inserts objects, retrying the ones weaviate rejects
+
+    Args:
+        collection: document collection
+        objects: properties and vector keyed by uuid
+
+    Returns:
+        uuids that still failed after LOADER_MAX_RETRIES retries
+    """
+    pending = objects
+    for attempt in range(LOADER_MAX_RETRIES + 1):
+        if attempt > 0:
+            time.sleep(0.5 * 2 ** (attempt - 1))
+        with collection.batch.dynamic() as batch:
+            for uuid, (properties, vector) in pending.items():
+                batch.add_object(properties=properties, vector=vector, uuid=uuid)
+        failed = {str(obj.object_.uuid) for obj in collection.batch.failed_objects}
+        if len(failed) == 0:
+            return set()
+        print(f"Failed to import {len(failed)} objects on attempt {attempt + 1}")
+        pending = {uuid: objects[uuid] for uuid in failed if uuid in objects}
+    return set(pending)
 
 
 def load_db():
     collection_name = "document_collection"
     client = None
+    embedding_model: TextEmbeddingsInference | None = None
     try:
         client = weaviate.connect_to_local(host=WEAVIATE_HOST, port=int(WEAVIATE_PORT))
+        documents = client.collections.get(collection_name)
 
-        if client.collections.exists(collection_name):
-            collection = client.collections.get(collection_name)
-            count = 0
-            for _ in collection.iterator():
-                count += 1
-            if count > 0:
-                client.close()
-                return
-
-        documents = SimpleDirectoryReader("documents", recursive=True).load_data()
-
-        splitter = MarkdownNodeParser()
+        existing = existing_ids(documents)
+        checkpoint = Checkpoint(LOADER_CHECKPOINT)
+        paths = SimpleDirectoryReader("documents", recursive=True).input_files
 
-        nodes = splitter.get_nodes_from_documents(documents, show_progress=True)
+        parse_stats = StageStats("parse", "chunks")
+        embed_stats = StageStats("embed", "vectors")
+        insert_stats = StageStats("insert", "objects")
+        desired: set[str] = set()
+        seen: set[str] = set()
+        failed: set[str] = set()
 
-        texts = [node.get_content(metadata_mode=MetadataMode.NONE) for node in nodes]
+        def parse_sources(paths: Iterable[Path]) -> Iterator[SourceFile]:
+            """Parses the files in a process pool, keeping at most two files
+            per worker in flight and yielding them in order"""
+            window: deque[tuple[str, str, Future | list[str]]] = deque()
 
-        metadata_lst: list[dict[str, Any]] = []
-        word = "documents"
-        url = "https://docs.pola.rs/user-guide"
+            def resolve(relative_path: str, fingerprint: str, parsed) -> SourceFile:
+                if isinstance(parsed, list):
+                    return SourceFile(relative_path, fingerprint, parsed, {})
+                started = time.perf_counter()
+                chunks = parsed.result()
+                parse_stats.add(len(chunks), started)
+                new = {k: v for k, v in chunks.items() if k not in existing}
+                return SourceFile(relative_path, fingerprint, list(chunks), new)
 
-        for node in nodes:
-            node.get_content()
-            meta = node.metadata | {
-                "text": node.get_content(metadata_mode=MetadataMode.NONE)
-            }
-            file_path = node.metadata["file_path"]
-            start_idx = file_path.find(word) + len(word)
-            link = url + file_path[start_idx:-8]
-            meta = meta | {"link": link} | {"embedding_model": EMBEDDING_MODEL}
+            with ProcessPoolExecutor(
+                LOADER_PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                for path in paths:
+                    stat = path.stat()
+                    relative_path = relative_to_documents(str(path))
+                    fingerprint = f"{stat.st_size}:{stat.st_mtime_ns}"
+                    ids = checkpoint.lookup(relative_path, fingerprint)
+                    if ids is not None and all(uuid in existing for uuid in ids):
+                        window.append((relative_path, fingerprint, ids))
+                    else:
+                        future = executor.submit(parse_file, path)
+                        window.append((relative_path, fingerprint, future))
+                    while len(window) > 2 * LOADER_PARSE_WORKERS:
+                        yield resolve(*window.popleft())
+                while window:
+                    yield resolve(*window.popleft())
 
-            metadata_lst.append(meta)
+        def parse_stage(paths: Iterable[Path]) -> Iterator[Batch]:
+            files: list[SourceFile] = []
+            pending = 0
+            for source in parse_sources(paths):
+                relative_path = source.relative_path
+                seen.add(relative_path)
+                desired.update(source.ids)
+                files.append(source)
+                pending += len(source.new)
+                if pending >= LOADER_BATCH_SIZE:
+                    yield Batch(files)
+                    files, pending = [], 0
+            if files:
+                yield Batch(files)
 
-        documents = client.collections.get(collection_name)
+        def embed_stage(batches: Iterable[Batch]) -> Iterator[Batch]:
+            nonlocal embedding_model
+            for batch in batches:
+                texts = [properties["text"] for _, properties in batch.new_chunks()]
+                if texts:
+                    if embedding_model is None:
+                        # created on demand so an unchanged corpus makes no
+                        # TEI calls
+                        embedding_model = TextEmbeddingsInference(
+                            url=f"http://{TEI_HOST}:{TEI_PORT}",
+                            normalize=True,
+                            batch_size=TEI_BATCH_SIZE,
+                            max_concurrency=TEI_MAX_CONCURRENCY,
+                            model=EMBEDDING_MODEL,
+                            cache_dir=EMBEDDING_CACHE_DIR or None,
+                        )
+                        embedding_model.wait_until_healthy()
+                        embedding_model.sync_server_limits()
+                    started = time.perf_counter()
+                    batch.vectors = embedding_model.embed_documents(texts)
+                    embed_stats.add(len(texts), started)
+                yield batch
 
-        tei_url = f"http://{TEI_HOST}:{TEI_PORT}"
-        embedding_model = TextEmbeddingsInference(url=tei_url, normalize=True)
-        embeddings = embedding_model.embed_documents(texts)
+        def insert_stage(batches: Iterable[Batch]) -> Iterator[Batch]:
+            for batch in batches:
+                chunks = batch.new_chunks()
+                if chunks:
+                    started = time.perf_counter()
+                    objects = {}
+                    for (uuid, doc), vector in zip(chunks, batch.vectors):
+                        objects[uuid] = (doc, vector)
+                    batch_failed = insert_objects(documents, objects)
+                    failed.update(batch_failed)
+                    insert_stats.add(len(objects) - len(batch_failed), started)
+                else:
+                    batch_failed = set()
+                # files with failed chunks are parsed again on the next run
+                for source in batch.files:
+                    if not any(uuid in batch_failed for uuid in source.new):
+                        checkpoint.add(source)
+                checkpoint.save()
+                yield batch
 
-        # Enter context manager
-        with documents.batch.dynamic() as batch:
-            # Loop through the data
-            for idx, doc in enumerate(metadata_lst):
-                # Convert data types
+        Pipeline(LOADER_QUEUE_SIZE).run(paths, [parse_stage, embed_stage, insert_stage])
 
-                for k, v in doc.items():
-                    if "date" in k:
-                        doc[k] = pd.to_datetime(v,utc=True).to_pydatetime()
+        for stats in (parse_stats, embed_stats, insert_stats):
+            print(stats.report())
+        if len(failed) > 0:
+            print(f"Failed to import {len(failed)} objects after retries")
 
-                # Add object to batch queue
-                batch.add_object(properties=doc, vector=embeddings[idx])
-                # Batcher automatically sends batches
+        # removed only after the new chunks are in, so retrieval never finds
+        # a file missing in between
+        stale_ids = [uuid for uuid in existing if uuid not in desired]
+        if len(stale_ids) > 0:
+            print(f"Deleted {delete_ids(documents, stale_ids)} objects")
+        checkpoint.retain(seen)
+        checkpoint.save()
 
-        # Check for failed objects
-        if len(documents.batch.failed_objects) > 0:
-            print(f"Failed to import {len(documents.batch.failed_objects)} objects")
+        if insert_stats.count > 0 or len(stale_ids) > 0:
+            invalidate_retrieval_cache()
     except Exception as e:
         print(e)
     finally:
+        if embedding_model is not None:
+            embedding_model.close()
         if client is not None:
             client.close()
 
@@ -0,0 +1,110 @@
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator
+
+# marks the end of a stage's output
+DONE = object()
+
+
+class StageStats:
+    """Items processed by a pipeline stage and the time it spent working"""
+
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.count = 0
+        self.busy = 0.0
+
+    def add(self, count: int, started: float) -> None:
+        self.count += count
+        self.busy += time.perf_counter() - started
+
+    def report(self) -> str:
+        rate = self.count / self.busy if self.busy > 0 else 0.0
+        return (
+            f"{self.name}: {self.count} {self.unit} in {self.busy:.1f}s "
+            f"({rate:.1f} {self.unit}/s)"
+        )
+
+
+class Pipeline:
+    def __init__(self, queue_size: int = 4):
+        """
+        Run stages in threads connected by bounded queues
+
+        A stage that is ahead blocks once queue_size items wait for the next
+        one, so memory stays bounded whatever the corpus size. The first
+        error stops every stage and is raised from run.
+        """
+        self.queue_size = queue_size
+        self._stop = threading.Event()
+        self._errors: list[BaseException] = []
+
+    def _put(self, q: queue.Queue, item: Any) -> bool:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue) -> Iterator[Any]:
+        while not self._stop.is_set():
+            try:
+                item = q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if item is DONE:
+                return
+            yield item
+
+    def _run_stage(
+        self,
+        stage: Callable[[Iterable[Any]], Iterable[Any]],
+        source: Iterable[Any],
+        sink: queue.Queue | None,
+    ) -> None:
+        try:
+            for item in stage(source):
+                if sink is not None and not self._put(sink, item):
+                    return
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            if sink is not None:
+                self._put(sink, DONE)
+
+    def run(
+        self,
+        source: Iterable[Any],
+        stages: list[Callable[[Iterable[Any]], Iterable[Any]]],
+    ) -> None:
+        """Feeds source through stages, each stage consuming the output of
+        the previous one
+
+        Args:
+            source: items for the first stage
+            stages: generator functions taking an iterable of items
+        """
+        threads: list[threading.Thread] = []
+        upstream: Iterable[Any] = source
+        for idx, stage in enumerate(stages):
+            sink = queue.Queue(self.queue_size) if idx < len(stages) - 1 else None
+            thread = threading.Thread(
+                target=self._run_stage,
+                args=(stage, upstream, sink),
+                name=getattr(stage, "__name__", "stage"),
+                daemon=True,
+            )
+            threads.append(thread)
+            if sink is not None:
+                upstream = self._get(sink)
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self._errors:
+            raise self._errors[0]